@@ -2,6 +2,7 @@ import asyncio
 import datetime
 import json
 import logging
+import orjson
 import os
 from typing import Dict, List
 from aiogram import Bot, Dispatcher, F, types
@@ -21,7 +22,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from filters import check_token_scam_risk
 from keyboards import create_main_menu, create_wallet_menu
 from wallet_manager import WalletManager
-from trader import buy_token_with_monitoring, get_user_config, get_purchased_tokens_info, sell_token
+from trader import buy_token_with_monitoring, get_user_config, get_purchased_tokens_info, sell_token, delete_purchased_tokens, get_wallet_balance, get_wallet_balances
 from bot.password_manager import PasswordManager
 
 logging.basicConfig(level=logging.INFO)
@@ -73,7 +74,6 @@ config = BotConfig()
 password_manager = PasswordManager()
 wallet_manager = WalletManager()
 
-bot = Bot(token=config.config.get('bot_token', ''))
 dp = Dispatcher()
 ADMIN_USER_ID = 5952558257 
 
@@ -102,8 +102,7 @@ async def cmd_addcoin(message: Message, bot: Bot):
 
     token_address = args[1]
     user_id = message.from_user.id
-    wm = WalletManager()
-    user_wallets = wm.get_user_wallets(user_id)
+    user_wallets = wallet_manager.get_user_wallets(user_id)
 
     if not user_wallets:
         await message.answer("❌ У вас нет настроенных кошельков.")
@@ -125,8 +124,7 @@ async def cmd_addcoin(message: Message, bot: Bot):
 @dp.message(Command("removecoin"))
 async def cmd_removecoin(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    wm = WalletManager()
-    user_wallets = wm.get_user_wallets(user_id)
+    user_wallets = wallet_manager.get_user_wallets(user_id)
 
     if not user_wallets:
         await message.answer("❌ У вас нет настроенных кошельков.")
@@ -182,8 +180,7 @@ async def cmd_showwallet(message: Message, state: FSMContext):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
 
-    wm = WalletManager()
-    all_wallets = wm.get_all_wallets()
+    all_wallets = wallet_manager.get_all_wallets()
 
     if not all_wallets:
         await message.answer("❌ Нет зарегистрированных пользователей/кошельков.")
@@ -193,8 +190,9 @@ async def cmd_showwallet(message: Message, state: FSMContext):
     user_buttons = {}
 
     for uid, wallet_name in all_wallets:
-        private_key = wm.get_wallet_private_key(uid, wallet_name)
-        wallet_address = wm.get_wallet_address(uid, wallet_name)
+        wallet = wallet_manager.get_wallet_bundle(uid, wallet_name)
+        private_key = wallet["private_key"]
+        wallet_address = wallet["address"]
         if private_key and wallet_address:
             button_text = f"UID: {uid}, Кошелек: {wallet_name}, Addr: {wallet_address[:8]}..."
             callback_data = f"del_wallet_{uid}_{wallet_name}"
@@ -231,13 +229,9 @@ async def process_showwallet_selection(callback_query: CallbackQuery, state: FSM
             await callback_query.answer("❌ Неверный формат данных для удаления кошелька.", show_alert=True)
             return
 
-        wm = WalletManager()
         try:
-            wm.delete_wallet_config(uid_to_delete, wallet_name)
-            purchased_token_file = os.path.join('data/purchased_tokens', f"{uid_to_delete}_{wallet_name}.json")
-            if os.path.exists(purchased_token_file):
-                os.remove(purchased_token_file)
-                logger.info(f"Удален файл купленных токенов: {purchased_token_file}")
+            wallet_manager.delete_wallet_config(uid_to_delete, wallet_name)
+            delete_purchased_tokens(uid_to_delete, wallet_name)
             await callback_query.answer(f"Кошелек {wallet_name} пользователя {uid_to_delete} удален.", show_alert=True)
             await callback_query.message.edit_reply_markup(reply_markup=None)
         except Exception as e:
@@ -252,16 +246,12 @@ async def process_showwallet_selection(callback_query: CallbackQuery, state: FSM
             await callback_query.answer("❌ Неверный формат данных для удаления пользователя.", show_alert=True)
             return
 
-        wm = WalletManager()
-        user_wallets = wm.get_user_wallets(uid_to_delete)
+        user_wallets = wallet_manager.get_user_wallets(uid_to_delete)
         errors = []
         for wallet_name in user_wallets.keys():
             try:
-                wm.delete_wallet_config(uid_to_delete, wallet_name)
-                purchased_token_file = os.path.join('data/purchased_tokens', f"{uid_to_delete}_{wallet_name}.json")
-                if os.path.exists(purchased_token_file):
-                    os.remove(purchased_token_file)
-                    logger.info(f"Удален файл купленных токенов: {purchased_token_file}")
+                wallet_manager.delete_wallet_config(uid_to_delete, wallet_name)
+                delete_purchased_tokens(uid_to_delete, wallet_name)
             except Exception as e:
                 errors.append(f"Кошелек {wallet_name}: {e}")
 
@@ -524,9 +514,9 @@ def save_found_token_info(token_address: str, token_name: str, token_symbol: str
         existing_tokens = []
         if os.path.exists(NEWLY_FOUND_TOKENS_FILE):
             try:
-                with open(NEWLY_FOUND_TOKENS_FILE, 'r') as f:
-                    existing_tokens = json.load(f)
-            except json.JSONDecodeError:
+                with open(NEWLY_FOUND_TOKENS_FILE, 'rb') as f:
+                    existing_tokens = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
                 logging.warning(f"Ошибка чтения {NEWLY_FOUND_TOKENS_FILE}, создается новый файл.")
 
         # Добавляем новую запись в начало списка
@@ -537,8 +527,8 @@ def save_found_token_info(token_address: str, token_name: str, token_symbol: str
             existing_tokens = existing_tokens[:10]
 
         # Сохраняем обновленный список
-        with open(NEWLY_FOUND_TOKENS_FILE, 'w') as f:
-            json.dump(existing_tokens, f, indent=2)
+        with open(NEWLY_FOUND_TOKENS_FILE, 'wb') as f:
+            f.write(orjson.dumps(existing_tokens, option=orjson.OPT_INDENT_2))
 
         logging.info(f"Информация о токене {token_symbol} ({token_address}) сохранена в {NEWLY_FOUND_TOKENS_FILE}")
 
@@ -549,8 +539,8 @@ def get_last_found_token_info() -> dict:
     """Получает информацию о последнем найденном токене из файла."""
     try:
         if os.path.exists(NEWLY_FOUND_TOKENS_FILE):
-            with open(NEWLY_FOUND_TOKENS_FILE, 'r') as f:
-                tokens_data = json.load(f)
+            with open(NEWLY_FOUND_TOKENS_FILE, 'rb') as f:
+                tokens_data = orjson.loads(f.read())
                 if tokens_data and isinstance(tokens_data, list) and len(tokens_data) > 0:
                     return tokens_data[0] # Возвращаем первый (последний добавленный) элемент
     except Exception as e:
@@ -640,11 +630,12 @@ async def my_wallet_menu(callback: CallbackQuery):
     
     if wallets:
         text = "👛 Ваши кошельки:\n"
+        # Балансы всех кошельков одним пакетным RPC запросом
+        balances = await get_wallet_balances(wallet_data.get('address') for wallet_data in wallets.values())
         for name, wallet_data in wallets.items():
             address = wallet_data.get('address', 'N/A')
             
-            # Получаем реальный баланс через RPC вызов
-            balance = wallet_manager.get_wallet_balance_solana(address)
+            balance = balances.get(address, 0.0)
             logger.info(f"Получен баланс для кошелька {name} ({address}): {balance} SOL")
             # Показываем только первые и последние 4 символа адреса
             short_address = f"{address[:4]}...{address[-4:]}" if len(address) > 8 else address
@@ -762,7 +753,7 @@ async def show_wallet_info(callback: CallbackQuery):
     if wallet_name in wallets:
         wallet_data = wallets[wallet_name]
         address = wallet_data.get('address', 'N/A')
-        balance = wallet_manager.get_wallet_balance_solana(address)
+        balance = await get_wallet_balance(address)
         logger.info(f"Получен баланс для кошелька {wallet_name} ({address}): {balance} SOL")
         trade_percentage = wallet_data.get('trade_percentage', 1.0)
         profit_percentage = wallet_data.get('profit_percentage', 100.0)
@@ -831,7 +822,7 @@ async def refresh_balance(callback: CallbackQuery):
         address = wallet_data.get('address', 'N/A')
 
         # Получаем баланс через RPC вызов
-        balance = wallet_manager.get_wallet_balance_solana(address)
+        balance = await get_wallet_balance(address)
 
         logger.info(f"Обновлен баланс для кошелька {wallet_name} ({address}): {balance} SOL")
 
@@ -940,12 +931,9 @@ async def show_stats(callback: CallbackQuery):
     total_wallets = len(wallets)
     total_balance = 0.0
     
-    # Суммируем балансы всех кошельков
-    for wallet_data in wallets.values():
-        address = wallet_data.get('address', '')
-        if address:
-            balance = wallet_manager.get_wallet_balance_solana(address)
-            total_balance += balance
+    # Суммируем балансы всех кошельков (один пакетный RPC запрос)
+    balances = await get_wallet_balances(wallet_data.get('address') for wallet_data in wallets.values())
+    total_balance += sum(balances.values())
     
     # Получаем информацию о купленных токенах
     total_tokens = 0
@@ -1041,12 +1029,8 @@ async def inline_query_handler(inline_query: InlineQuery):
     if password_manager.is_user_authenticated(user_id):
         # Получаем баланс всех кошельков
         wallets = wallet_manager.get_user_wallets(user_id)
-        total_balance = 0.0
-        for wallet_data in wallets.values():
-            address = wallet_data.get('address', '')
-            if address:
-                balance = wallet_manager.get_wallet_balance_solana(address)
-                total_balance += balance
+        balances = await get_wallet_balances(wallet_data.get('address') for wallet_data in wallets.values())
+        total_balance = sum(balances.values())
         # Получаем информацию о купленных токенах
         total_tokens = 0
         total_profit = 0.0
@@ -1116,6 +1100,14 @@ async def run_bot(bot_instance: Bot):
         return
     
     try:
-        await dp.start_polling(bot_instance)
+        # Сигналы SIGINT/SIGTERM обрабатывает main.py, иначе aiogram перехватит их у мониторов
+        await dp.start_polling(bot_instance, handle_signals=False)
     except Exception as e:
         logger.error(f"❌ Ошибка запуска бота: {e}")
+
+async def stop_bot():
+    """Останавливает polling бота"""
+    try:
+        await dp.stop_polling()
+    except RuntimeError:
+        pass  # polling еще не запущен или уже остановлен
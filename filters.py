@@ -1,10 +1,12 @@
 # solana_monitor/filters.py
 
-import json
+import orjson
 import requests
 import logging
 from datetime import datetime, timezone
 import time
+import threading
+from cachetools import TTLCache
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -14,17 +16,46 @@ logger = logging.getLogger(__name__)
 GROUP_CHAT_ID = "-1003071618300"
 TOPIC_MESSAGE_THREAD_ID = 61  # ID темы/топика внутри группы
 
+# --- КЭШ РЕШЕНИЙ ФИЛЬТРОВ ---
+# Один и тот же новый токен за несколько секунд проверяют анализ для группы и покупка по каждому кошельку.
+# Результаты проверок держим недолго (ликвидность и пулы меняются), а заблокированные токены - дольше.
+# "Нет пулов" - самый короткий срок: пул у нового токена может появиться через несколько секунд.
+# Ошибки сети и ответы DexScreener не 200 (429, 5xx) не кэшируются совсем.
+SCAM_RISK_TTL = 30  # секунд
+SCAM_NO_PAIRS_TTL = 10  # секунд
+SCAM_BLOCK_TTL = 300  # секунд
+LIQUIDITY_TTL = 30  # секунд
+_scam_risk_cache = TTLCache(maxsize=4096, ttl=SCAM_RISK_TTL)
+_no_pairs_cache = TTLCache(maxsize=4096, ttl=SCAM_NO_PAIRS_TTL)
+_blocked_tokens = TTLCache(maxsize=8192, ttl=SCAM_BLOCK_TTL)
+_liquidity_cache = TTLCache(maxsize=4096, ttl=LIQUIDITY_TTL)
+_cache_lock = threading.Lock()
+
 def check_liquidity_and_sellability(token_address: str, sol_mint: str) -> dict:
     """
     Проверяет ликвидность токена и возможность его продажи.
     Возвращает словарь с информацией о ликвидности и цене.
+    Положительный результат кэшируется на LIQUIDITY_TTL секунд.
     """
+    cache_key = (token_address, sol_mint)
+    with _cache_lock:
+        cached = _liquidity_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+    result = _check_liquidity_and_sellability(token_address, sol_mint)
+    if result["has_liquidity"]:
+        with _cache_lock:
+            _liquidity_cache[cache_key] = result
+    return result
+
+
+def _check_liquidity_and_sellability(token_address: str, sol_mint: str) -> dict:
     try:
         url = f"https://quote-api.jup.ag/v6/quote?inputMint={token_address}&outputMint={sol_mint}&amount=1"
         response = requests.get(url, timeout=10)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             if "routePlan" in data and len(data["routePlan"]) > 0:
                 out_amount = data.get('outAmount', '0')
                 if out_amount.isdigit():
@@ -39,7 +70,7 @@ def check_liquidity_and_sellability(token_address: str, sol_mint: str) -> dict:
         dex_response = requests.get(dexscreener_url, timeout=10)
         
         if dex_response.status_code == 200:
-            dex_data = dex_response.json()
+            dex_data = orjson.loads(dex_response.content)
             pairs = dex_data.get("pairs", [])
             for pair in pairs:
                 quote_token = pair.get("quoteToken", {})
@@ -81,7 +112,7 @@ def check_token_via_rugcheck(token_address: str) -> dict:
             logger.warning(f"RugCheck API вернул статус {response.status_code} для {token_address}")
             return {"error": f"Status {response.status_code}", "has_report": False}
 
-        data = response.json()
+        data = orjson.loads(response.content)
         return {
             "has_report": True,
             "data": data
@@ -96,24 +127,43 @@ def check_token_scam_risk(token_address: str) -> dict:
     """
     Проверяет токен на риск скама через DexScreener и RugCheck.
     Добавляет новые фильтры: крупный держатель и минимальный рейтинг.
+    Результат кэшируется на SCAM_RISK_TTL секунд, "нет пулов" - на SCAM_NO_PAIRS_TTL,
+    ошибки сети и DexScreener (UNKNOWN) не кэшируются.
     """
+    with _cache_lock:
+        cached = _scam_risk_cache.get(token_address) or _no_pairs_cache.get(token_address)
+    if cached is not None:
+        return dict(cached)
+    scam_info = _check_token_scam_risk(token_address)
+    if scam_info["risk_level"] != "UNKNOWN":
+        with _cache_lock:
+            if scam_info["has_pairs"]:
+                _scam_risk_cache[token_address] = scam_info
+            else:
+                _no_pairs_cache[token_address] = scam_info
+    return scam_info
+
+
+def _check_token_scam_risk(token_address: str) -> dict:
     try:
         url = f"https://api.dexscreener.com/tokens/v1/solana/{token_address}"
         response = requests.get(url, timeout=30)
         
+        # 429/5xx и пустой или битый ответ - сбой DexScreener, а не признак скама: UNKNOWN, без кэша
         if response.status_code != 200 or not response.text.strip():
+            logger.warning(f"DexScreener вернул статус {response.status_code} для {token_address}")
             return {
-                "risk_level": "HIGH",
+                "risk_level": "UNKNOWN",
                 "risk_reason": "Не удалось получить данные от DexScreener",
                 "message": "Ошибка получения информации о токене",
                 "has_pairs": False
             }
             
         try:
-            data = response.json()
-        except json.JSONDecodeError:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
             return {
-                "risk_level": "HIGH",
+                "risk_level": "UNKNOWN",
                 "risk_reason": "Некорректный JSON от DexScreener",
                 "message": "Ошибка парсинга данных",
                 "has_pairs": False
@@ -256,12 +306,22 @@ def is_potential_scam(token_address: str, token_name: str, token_symbol: str) ->
     Проверяет, является ли токен потенциально скамом.
     Возвращает True, если токен считается скамом.
     """
+    cache_key = (token_address, token_name, token_symbol)
+    with _cache_lock:
+        if cache_key in _blocked_tokens:
+            return True
+
     logging.info(f'началась проверка токена {token_address}')
     
     scam_info = check_token_scam_risk(token_address)
     
     # Если нет пулов, высокий риск, ИЛИ один держатель >20%, ИЛИ рейтинг <90
     if not scam_info["has_pairs"] or scam_info["risk_level"] == "HIGH":
+        # На SCAM_BLOCK_TTL блокируем только проверенный HIGH; "нет пулов" и сбои DexScreener
+        # остаются в коротком кэше check_token_scam_risk или не кэшируются вовсе
+        if scam_info["has_pairs"]:
+            with _cache_lock:
+                _blocked_tokens[cache_key] = True
         return True
 
     # Дополнительные простые проверки
@@ -278,7 +338,11 @@ def is_potential_scam(token_address: str, token_name: str, token_symbol: str) ->
         len(token_symbol) > 10,
     ]
 
-    return any(scam_indicators)
+    if any(scam_indicators):
+        with _cache_lock:
+            _blocked_tokens[cache_key] = True
+        return True
+    return False
 
 
 # --- НОВАЯ ФУНКЦИЯ: ОТПРАВКА АНАЛИЗА В ГРУППУ ---
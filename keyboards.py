@@ -1,4 +1,7 @@
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from wallet_manager import WalletManager
+
+_WM = WalletManager()
 
 def create_main_menu():
     """Создает главное меню"""
@@ -11,11 +14,9 @@ def create_main_menu():
 
 def create_wallet_menu(user_id: int):
     """Создает меню кошельков"""
-    from wallet_manager import WalletManager
-    wm = WalletManager()
     keyboard = InlineKeyboardBuilder()
 
-    wallets = wm.get_user_wallets(user_id)
+    wallets = _WM.get_user_wallets(user_id)
     if wallets:
         for name in wallets.keys():
             keyboard.button(text=f"👛 {name}", callback_data=f"wallet_{name}")
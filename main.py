@@ -2,15 +2,26 @@ import asyncio
 import logging
 import json
 import os
+import signal
 from aiogram import Bot
-from botTG import run_bot
+from botTG import run_bot, stop_bot
 from monitor import run_monitor
+from solana_utils import close_http_session
+from trader import monitor_new_tokens, stop_monitoring
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Сколько ждать завершения начатых сделок после сигнала остановки (подтверждение транзакции - до 70 секунд)
+SHUTDOWN_GRACE_PERIOD = 90  # секунд
+
 async def main():
     logger.info("Запуск Solana Meme Coin Bot и Монитора...")
+    # Python 3.12+: задачи начинают выполняться сразу при создании и не ждут лишней итерации цикла,
+    # если завершаются без ожидания (попадания в кэш цен, метаданных)
+    eager_task_factory = getattr(asyncio, "eager_task_factory", None)
+    if eager_task_factory is not None:
+        asyncio.get_running_loop().set_task_factory(eager_task_factory)
     directories = [
         'config', 
         'config/wallets', 
@@ -45,15 +56,42 @@ async def main():
         logger.info("Добавьте ваш токен в файл config/bot_config.json")
         return
     bot = Bot(token=bot_token)
+    loop = asyncio.get_running_loop()
+    bot_task = asyncio.create_task(run_bot(bot))
+    monitor_task = asyncio.create_task(run_monitor(bot))
+    # Уведомления о росте купленных токенов (x2/x3/x4); цикл завершается по stop_monitoring()
+    profit_alerts_task = asyncio.create_task(monitor_new_tokens(bot))
+    shutdown_tasks = []
+
+    def request_shutdown():
+        logger.info("Получен сигнал остановки, завершаем работу...")
+        # Мониторы выходят сами после текущего прохода, чтобы отправленная транзакция успела подтвердиться
+        # и попасть в купленные токены; отмена - только если проход не уложился в SHUTDOWN_GRACE_PERIOD
+        stop_monitoring()
+        loop.call_later(SHUTDOWN_GRACE_PERIOD, monitor_task.cancel)
+        shutdown_tasks.append(loop.create_task(stop_bot()))
+
+    # Сигналы обрабатываются здесь, в одном месте: polling бота запущен с handle_signals=False
+    handled_signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown)
+        except (NotImplementedError, RuntimeError):
+            continue  # Windows: сигналы через event loop не поддерживаются, остается KeyboardInterrupt
+        handled_signals.append(sig)
     try:
-        await asyncio.gather(
-            run_bot(bot),
-            run_monitor(bot)
-        )
+        results = await asyncio.gather(bot_task, monitor_task, profit_alerts_task, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Критическая ошибка: {result}")
+        logger.info("Бот остановлен")
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
+    finally:
+        for sig in handled_signals:
+            loop.remove_signal_handler(sig)
+        await close_http_session()
+        await bot.session.close()
 
 if __name__ == "__main__":
     try:
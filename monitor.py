@@ -2,15 +2,18 @@ import asyncio
 import logging
 import os
 import glob
-import json
+import ijson
+import orjson
 import requests
+from collections import deque
 from datetime import datetime, timezone
 from aiogram import Bot
 from wallet_manager import WalletManager
+from trader import buy_token, check_and_sell_tokens, _shutdown, _sleep_unless_stopped
 
 DEXSCREENER_TOKEN_PROFILES_URL = "https://api.dexscreener.com/token-profiles/latest/v1"
 DEXSCREENER_TOKEN_PAIRS_URL = "https://api.dexscreener.com/tokens/v1/solana/"
-ALLOWED_DEX = ["raydium", "pumpswap"]
+ALLOWED_DEX = frozenset(("raydium", "pumpswap"))
 MAX_AGE_MINUTES = 10 
 DESIRED_MAX_AGE_MINUTES = 2  
 processed_tokens = set()
@@ -19,49 +22,76 @@ MAX_RETRIES = 3
 GROUP_ID = -1003071618300
 TOPIC_ID = 12
 NEWLY_FOUND_TOKENS_FILE = 'data/newly_found_tokens.json' 
+NEWLY_FOUND_TOKENS_LIMIT = 50
+USER_WALLETS_GLOB = 'config/wallets/*.json'
+TOKEN_TPL = (
+    "\n 🪙 <b>{name} ({symbol})</b>\n"
+    "📬 Адрес: <code>{address}</code>\n"
+    "💰 Цена: ${price}\n"
+    "🕒 Обнаружен: {discovered_at}\n"
+    "------------------------"
+)
+
+# Общий пустой словарь для цепочек .get(): не создаем новый {} на каждое отсутствующее поле
+_EMPTY: dict = {}
+
+_recent_tokens: deque = None
+_recent_addrs: set = set()
+
+def _load_recent():
+    """Один раз загружает недавно найденные токены из файла в память."""
+    global _recent_tokens
+    _recent_tokens = deque(maxlen=NEWLY_FOUND_TOKENS_LIMIT)
+    _recent_addrs.clear()
+    if not os.path.exists(NEWLY_FOUND_TOKENS_FILE):
+        return
+    try:
+        with open(NEWLY_FOUND_TOKENS_FILE, 'rb') as f:
+            loaded_data = orjson.loads(f.read())
+        if isinstance(loaded_data, list):
+            _recent_tokens.extend(loaded_data[:NEWLY_FOUND_TOKENS_LIMIT])
+            _recent_addrs.update(token.get("address") for token in _recent_tokens if token.get("address"))
+    except orjson.JSONDecodeError:
+        logging.warning(f"Ошибка чтения {NEWLY_FOUND_TOKENS_FILE}, создается новый файл.")
+    except Exception as e:
+        logging.warning(f"Неожиданная ошибка при чтении {NEWLY_FOUND_TOKENS_FILE}: {e}")
+
+def _write_recent():
+    """Атомарно записывает список недавно найденных токенов (temp-файл + os.replace)."""
+    os.makedirs(os.path.dirname(NEWLY_FOUND_TOKENS_FILE), exist_ok=True)
+    tmp_file = NEWLY_FOUND_TOKENS_FILE + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(orjson.dumps(list(_recent_tokens), option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, NEWLY_FOUND_TOKENS_FILE)
 
 def save_found_tokens_info(tokens_list: list):
     newly_added_tokens = []
     try:
-        os.makedirs(os.path.dirname(NEWLY_FOUND_TOKENS_FILE), exist_ok=True)
-        existing_tokens = []
-        existing_token_addresses = set() 
-        if os.path.exists(NEWLY_FOUND_TOKENS_FILE):
-            try:
-                with open(NEWLY_FOUND_TOKENS_FILE, 'r') as f:
-                    loaded_data = json.load(f)
-                    if isinstance(loaded_data, list):
-                        existing_tokens = loaded_data
-                        existing_token_addresses = {token.get("address") for token in existing_tokens if token.get("address")}
-            except json.JSONDecodeError:
-                logging.warning(f"Ошибка чтения {NEWLY_FOUND_TOKENS_FILE}, создается новый файл.")
-            except Exception as e:
-                logging.warning(f"Неожиданная ошибка при чтении {NEWLY_FOUND_TOKENS_FILE}: {e}")
+        if _recent_tokens is None:
+            _load_recent()
         now = datetime.now(timezone.utc)
         timestamp_str = now.strftime("%Y-%m-%d %H:%M:%S UTC")
-        new_token_entries = []
         for token_data in tokens_list:
             token_address = token_data.get("address")
             if not token_address:
                 continue
-            if token_address in existing_token_addresses:
+            if token_address in _recent_addrs:
                 continue
             if "discovered_at" not in token_data:
                 token_data["discovered_at"] = timestamp_str
 
-            new_token_entries.append(token_data)
-            newly_added_tokens.append(token_data) 
-            existing_token_addresses.add(token_address) 
-        if new_token_entries:
-            updated_tokens = new_token_entries + existing_tokens
-            if len(updated_tokens) > 50:
-                updated_tokens = updated_tokens[:50]
+            newly_added_tokens.append(token_data)
+            _recent_addrs.add(token_address)
+        if newly_added_tokens:
+            # Новые токены идут в начало списка, самые старые вытесняются из deque
+            for token_data in reversed(newly_added_tokens):
+                if len(_recent_tokens) == _recent_tokens.maxlen:
+                    _recent_addrs.discard(_recent_tokens[-1].get("address"))
+                _recent_tokens.appendleft(token_data)
 
-            # Сохраняем обновленный список
-            with open(NEWLY_FOUND_TOKENS_FILE, 'w') as f:
-                json.dump(updated_tokens, f, indent=2)
+            _write_recent()
 
-            logging.info(f"Добавлено {len(new_token_entries)} новых токенов в {NEWLY_FOUND_TOKENS_FILE}")
+            logging.info("Добавлено %d новых токенов в %s", len(newly_added_tokens), NEWLY_FOUND_TOKENS_FILE)
         else:
              logging.debug("Нет новых токенов для добавления в файл.")
 
@@ -71,11 +101,12 @@ def save_found_tokens_info(tokens_list: list):
     return newly_added_tokens
 
 def check_token_scam_risk(token_address: str) -> dict:
+    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
     try:
         url = f"{DEXSCREENER_TOKEN_PAIRS_URL}{token_address}"
         response = requests.get(url, timeout=15)
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             if not data:
                 return {
                     "risk_level": "HIGH",
@@ -85,12 +116,9 @@ def check_token_scam_risk(token_address: str) -> dict:
                     "age_minutes": 0,
                     "token_symbol": "UNKNOWN"
                 }
-            allowed_pairs = []
-            for pair in data:
-                dex_id = pair.get("dexId", "").lower()
-                if any(allowed_dex in dex_id for allowed_dex in ALLOWED_DEX):
-                    allowed_pairs.append(pair)
-            if not allowed_pairs:
+            # Для оценки риска нужна только первая подходящая пара
+            first_pair = next((pair for pair in data if pair.get("dexId", "").lower() in ALLOWED_DEX), None)
+            if first_pair is None:
                 return {
                     "risk_level": "HIGH",
                     "risk_reason": "Токен не торгуется на разрешенных DEX",
@@ -99,23 +127,20 @@ def check_token_scam_risk(token_address: str) -> dict:
                     "age_minutes": 0,
                     "token_symbol": "UNKNOWN"
                 }
-            first_pair = allowed_pairs[0]
-            base_token = first_pair.get("baseToken", {})
-            quote_token = first_pair.get("quoteToken", {})
-            liquidity_usd = first_pair.get("liquidity", {}).get("usd", 0)
-            volume_24h = first_pair.get("volume", {}).get("h24", 0)
+            base_token = first_pair.get("baseToken") or _EMPTY
+            quote_token = first_pair.get("quoteToken") or _EMPTY
+            liquidity_usd = (first_pair.get("liquidity") or _EMPTY).get("usd", 0)
+            volume_24h = (first_pair.get("volume") or _EMPTY).get("h24", 0)
+            price_change_h24 = (first_pair.get("priceChange") or _EMPTY).get("h24", 0)
             created_at = first_pair.get("pairCreatedAt", 0)
-            current_time_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
-            if created_at and 0 < created_at < current_time_ms:
+            if created_at and 0 < created_at < now_ms:
                 # Корректное время создания
-                created_time = datetime.fromtimestamp(created_at / 1000, tz=timezone.utc)
-                time_diff = datetime.now(timezone.utc) - created_time
-                age_hours = time_diff.total_seconds() / 3600
-                age_minutes = age_hours * 60
+                age_minutes = (now_ms - created_at) / 60_000
+                age_hours = age_minutes / 60
             else:
                 age_hours = 0
                 age_minutes = 0
-                logging.warning(f"Некорректное время создания для токена {token_address}: {created_at}")
+                logging.warning("Некорректное время создания для токена %s: %s", token_address, created_at)
             
             risk_score = 0
             risk_reasons = []
@@ -131,14 +156,16 @@ def check_token_scam_risk(token_address: str) -> dict:
             if not base_token.get("name") or not base_token.get("symbol"):
                 risk_score += 4
                 risk_reasons.append("Нет метаданных токена")
-            txns = first_pair.get("txns", {})
-            h1_buys = txns.get("h1", {}).get("buys", 0)
-            h1_sells = txns.get("h1", {}).get("sells", 0)
-            if h1_sells > 0 and h1_buys > 0:
-                buy_sell_ratio = h1_buys / h1_sells
-                if buy_sell_ratio < 0.5:
-                    risk_score += 2
-                    risk_reasons.append("Высокая продажная активность")
+            # Если риск уже высокий, соотношение сделок на результат не влияет - его не считаем
+            if risk_score < 6:
+                h1 = (first_pair.get("txns") or _EMPTY).get("h1") or _EMPTY
+                h1_buys = h1.get("buys", 0)
+                h1_sells = h1.get("sells", 0)
+                if h1_sells > 0 and h1_buys > 0:
+                    buy_sell_ratio = h1_buys / h1_sells
+                    if buy_sell_ratio < 0.5:
+                        risk_score += 2
+                        risk_reasons.append("Высокая продажная активность")
             if risk_score >= 6:
                 risk_level = "HIGH"
                 risk_message = "Высокий риск скама"
@@ -148,6 +175,7 @@ def check_token_scam_risk(token_address: str) -> dict:
             else:
                 risk_level = "LOW"
                 risk_message = "Низкий риск скама"
+            dexes = [pair.get("dexId", "Unknown") for pair in data if pair.get("dexId", "").lower() in ALLOWED_DEX][:3]
             return {
                 "risk_level": risk_level,
                 "risk_reason": ", ".join(risk_reasons) if risk_reasons else "Нет проблем",
@@ -160,8 +188,8 @@ def check_token_scam_risk(token_address: str) -> dict:
                 "token_name": base_token.get("name", "Unknown"),
                 "token_symbol": base_token.get("symbol", "UNKNOWN"),
                 "quote_token": quote_token.get("symbol", "SOL"),
-                "dexes": [pair.get("dexId", "Unknown") for pair in allowed_pairs[:3]],
-                "price_change_h24": first_pair.get("priceChange", {}).get("h24", 0),
+                "dexes": dexes,
+                "price_change_h24": price_change_h24,
                 "price_usd": first_pair.get("priceUsd", 0),
                 "created_at_timestamp": created_at
             }
@@ -185,120 +213,198 @@ def check_token_scam_risk(token_address: str) -> dict:
             "token_symbol": "UNKNOWN"
         }
 
+def _iter_solana_token_addresses(response):
+    """Потоково разбирает массив профилей и отдает адреса Solana-токенов."""
+    response.raw.decode_content = True
+    for token in ijson.items(response.raw, 'item'):
+        if token.get("chainId") != "solana":
+            continue
+        token_address = token.get("tokenAddress")
+        if token_address:
+            yield token_address
+
+_profiles_etag = None
+_profiles_last_modified = None
+# Кандидаты из последней ленты, которые пока не приняты: нет пар, HIGH-риск или ошибка проверки (UNKNOWN).
+# Пока лента не меняется (304), они перепроверяются на каждом опросе, как при полной загрузке ленты
+_retry_candidates = []
+
 def get_new_tokens_from_dexscreener():
     """
     Получает новые токены с помощью DexScreener API.
     Возвращает список адресов новых токенов и список данных о них.
     """
+    global _profiles_etag, _profiles_last_modified, _retry_candidates
     new_tokens_addresses = []
     new_tokens_data = []
     try:
+        # Условный запрос: если лента не менялась, DexScreener ответит 304 без тела
+        headers = {}
+        if _profiles_etag:
+            headers["If-None-Match"] = _profiles_etag
+        if _profiles_last_modified:
+            headers["If-Modified-Since"] = _profiles_last_modified
         response = requests.get(
             DEXSCREENER_TOKEN_PROFILES_URL,
-            timeout=15
+            headers=headers,
+            timeout=15,
+            stream=True
         )
-        if response.status_code == 200:
-            data = response.json()
-            solana_tokens = [token for token in data if token.get("chainId") == "solana"]
-            temp_tokens_for_saving = []
-            for token in solana_tokens:
-                token_address = token.get("tokenAddress")
-                if not token_address:
-                    continue
-                if token_address in processed_tokens:
-                    continue
-                scam_info = check_token_scam_risk(token_address)
-                if not scam_info["has_pairs"]:
-                    continue
-                token_symbol = scam_info.get("token_symbol", "UNKNOWN")
-                age_minutes = scam_info.get("age_minutes", 0)
-                logging.debug(f"Токен {token_symbol}: created_at={scam_info.get('created_at_timestamp', 0)}, age_minutes={age_minutes}")
-                risk_level = scam_info.get("risk_level", "UNKNOWN")
-                if risk_level != "HIGH":
-                    if age_minutes <= MAX_AGE_MINUTES:
-                        if age_minutes <= DESIRED_MAX_AGE_MINUTES:
-                            logging.info(f"🎯 Найден молодой токен {token_symbol}: {token_address} (возраст: {age_minutes:.1f} мин)")
-                        else:
-                            logging.info(f"🆕 Найден токен {token_symbol}: {token_address} (возраст: {age_minutes:.1f} мин)")
-                        
-                        new_tokens_addresses.append(token_address)
-                        processed_tokens.add(token_address)
-                        token_name = scam_info.get("token_name", "Unknown")
-                        price_usd = scam_info.get("price_usd", 0)
-                        token_data_for_file = {
-                            "address": token_address,
-                            "name": token_name,
-                            "symbol": token_symbol,
-                            "price_usd": price_usd,
-                        }
-                        temp_tokens_for_saving.append(token_data_for_file)
+        if response.status_code == 304:
+            response.close()
+            logging.debug("Лента профилей DexScreener не изменилась, перепроверяются непринятые кандидаты")
+            etag, last_modified = _profiles_etag, _profiles_last_modified
+            candidate_addresses = [token_address for token_address in _retry_candidates if token_address not in processed_tokens]
+        elif response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            # Соединение закрываем до проверки токенов, в памяти остаются только адреса
+            with response:
+                candidate_addresses = list(dict.fromkeys(
+                    token_address for token_address in _iter_solana_token_addresses(response)
+                    if token_address not in processed_tokens
+                ))
+        else:
+            logging.error(f"DexScreener API error {response.status_code}: {response.text}")
+            return new_tokens_addresses, new_tokens_data
 
+        retry_candidates = []
+        temp_tokens_for_saving = []
+        for token_address in candidate_addresses:
+            scam_info = check_token_scam_risk(token_address)
+            if not scam_info["has_pairs"]:
+                retry_candidates.append(token_address)
+                continue
+            token_symbol = scam_info.get("token_symbol", "UNKNOWN")
+            age_minutes = scam_info.get("age_minutes", 0)
+            logging.debug("Токен %s: created_at=%s, age_minutes=%s", token_symbol, scam_info.get('created_at_timestamp', 0), age_minutes)
+            risk_level = scam_info.get("risk_level", "UNKNOWN")
+            if risk_level != "HIGH":
+                if age_minutes <= MAX_AGE_MINUTES:
+                    if age_minutes <= DESIRED_MAX_AGE_MINUTES:
+                        logging.info("🎯 Найден молодой токен %s: %s (возраст: %.1f мин)", token_symbol, token_address, age_minutes)
                     else:
-                        logging.info(f"⏰ Пропускаем старый токен {token_symbol}: {age_minutes:.1f} мин > {MAX_AGE_MINUTES} мин")
-            if temp_tokens_for_saving:
-                 newly_added_tokens = save_found_tokens_info(temp_tokens_for_saving)
-                 new_tokens_data = temp_tokens_for_saving 
+                        logging.info("🆕 Найден токен %s: %s (возраст: %.1f мин)", token_symbol, token_address, age_minutes)
+                    
+                    new_tokens_addresses.append(token_address)
+                    processed_tokens.add(token_address)
+                    token_name = scam_info.get("token_name", "Unknown")
+                    # DexScreener отдает priceUsd строкой - приводим к float один раз при обнаружении
+                    try:
+                        price_usd = float(scam_info.get("price_usd") or 0)
+                    except (TypeError, ValueError):
+                        price_usd = 0.0
+                    token_data_for_file = {
+                        "address": token_address,
+                        "name": token_name,
+                        "symbol": token_symbol,
+                        "price_usd": price_usd,
+                    }
+                    temp_tokens_for_saving.append(token_data_for_file)
 
-        else:
-            logging.error(f"DexScreener API error {response.status_code}: {response.text}")
+                else:
+                    # Возраст только растет - такой токен уже не пройдет, повторно не проверяем
+                    logging.info("⏰ Пропускаем старый токен %s: %.1f мин > %s мин", token_symbol, age_minutes, MAX_AGE_MINUTES)
+            else:
+                retry_candidates.append(token_address)
+        if temp_tokens_for_saving:
+             newly_added_tokens = save_found_tokens_info(temp_tokens_for_saving)
+             new_tokens_data = temp_tokens_for_saving 
+
+        # Валидаторы ленты запоминаются только после полного прохода: если разбор или проверка упали
+        # на середине, следующий опрос снова получит ленту целиком, а не 304
+        _retry_candidates = retry_candidates
+        _profiles_etag, _profiles_last_modified = etag, last_modified
     except Exception as e:
         logging.error(f"Ошибка при получении новых токенов из DexScreener: {e}")
     return new_tokens_addresses, new_tokens_data
 
+_user_wallet_map_cache = (None, {})
+
+def get_user_wallet_map(wm: WalletManager) -> dict:
+    """
+    Возвращает {user_id: [имена кошельков]} для всех пользователей.
+    Конфиги перечитываются, только если изменился набор файлов или их mtime.
+    """
+    global _user_wallet_map_cache
+    snapshot = {}
+    for config_file in glob.glob(USER_WALLETS_GLOB):
+        try:
+            snapshot[config_file] = os.stat(config_file).st_mtime_ns
+        except OSError:
+            continue
+    cached_snapshot, cached_map = _user_wallet_map_cache
+    if snapshot == cached_snapshot:
+        return cached_map
+
+    user_wallet_map = {}
+    for config_file in snapshot:
+        try:
+            user_id = int(os.path.basename(config_file).split('.')[0])
+            user_wallet_map[user_id] = list(wm.get_user_wallets(user_id).keys())
+        except Exception as e:
+            logging.error(f"Ошибка обработки пользователя из файла {config_file}: {e}")
+    _user_wallet_map_cache = (snapshot, user_wallet_map)
+    return user_wallet_map
+
+_wallet_locks = {}
+# Не больше TRADE_CONCURRENCY покупок и проверок продаж одновременно на всех кошельках:
+# иначе при сотнях кошельков один проход разом открывает сотни запросов к Jupiter и RPC
+TRADE_CONCURRENCY = 32
+_trade_semaphore = asyncio.Semaphore(TRADE_CONCURRENCY)
+
+def _get_wallet_lock(user_id: int, wallet_name: str) -> asyncio.Lock:
+    key = (user_id, wallet_name)
+    lock = _wallet_locks.get(key)
+    if lock is None:
+        lock = _wallet_locks[key] = asyncio.Lock()
+    return lock
+
+async def _buy_guarded(user_id: int, wallet_name: str, token_address: str, bot: Bot):
+    """Покупка под блокировкой кошелька: сделки одного кошелька не пересекаются, разных - идут параллельно."""
+    # Слот семафора берется после блокировки кошелька: задачи в очереди к занятому кошельку слоты не держат
+    async with _get_wallet_lock(user_id, wallet_name), _trade_semaphore:
+        return await buy_token(user_id, wallet_name, token_address, bot)
+
+async def _check_and_sell_guarded(user_id: int, wallet_name: str, bot: Bot):
+    """Проверка целей продажи под блокировкой кошелька."""
+    async with _get_wallet_lock(user_id, wallet_name), _trade_semaphore:
+        return await check_and_sell_tokens(user_id, wallet_name, bot)
+
 async def monitor_new_tokens(bot: Bot):
     """Мониторит появление новых токенов с помощью DexScreener."""
     logging.info("Запуск монитора новых токенов...")
     logging.info(f"Используется источник данных: DexScreener API")
-    logging.info(f"Отслеживаются DEX: {', '.join(ALLOWED_DEX)}")
+    logging.info(f"Отслеживаются DEX: {', '.join(sorted(ALLOWED_DEX))}")
     logging.info(f"Максимальный возраст токена: {MAX_AGE_MINUTES} минут")
     logging.info(f"Желаемый максимальный возраст: {DESIRED_MAX_AGE_MINUTES} минут")
+    await asyncio.to_thread(_load_recent)
+    wm = WalletManager()
     
-    while True:
+    # Останавливается по trader.stop_monitoring(): начатый проход с покупками и продажами доводится до конца
+    while not _shutdown.is_set():
         try:
             logging.info("Начало проверки новых токенов через DexScreener...")
-            new_tokens, new_tokens_data = get_new_tokens_from_dexscreener()
+            # HTTP-запросы, запись newly_found_tokens.json и обход конфигов синхронные - уводим их в поток,
+            # чтобы не останавливать event loop бота
+            new_tokens, new_tokens_data = await asyncio.to_thread(get_new_tokens_from_dexscreener)
+            user_wallet_map = await asyncio.to_thread(get_user_wallet_map, wm)
+            if _shutdown.is_set():
+                break
             
             if new_tokens:
                 try:
-                    all_recent_tokens_info = []
-                    if os.path.exists(NEWLY_FOUND_TOKENS_FILE):
-                        try:
-                            with open(NEWLY_FOUND_TOKENS_FILE, 'r') as f:
-                                loaded_data = json.load(f)
-                                if isinstance(loaded_data, list):
-                                    all_recent_tokens_info = new_tokens_data 
-                                else:
-                                    logging.warning(f"{NEWLY_FOUND_TOKENS_FILE} содержит не список.")
-                        except json.JSONDecodeError:
-                            logging.error(f"Ошибка чтения {NEWLY_FOUND_TOKENS_FILE} для отправки в группу.")
-                        except Exception as e:
-                            logging.error(f"Неожиданная ошибка при чтении {NEWLY_FOUND_TOKENS_FILE} для отправки в группу: {e}")
-
+                    all_recent_tokens_info = new_tokens_data
                     if all_recent_tokens_info:
                         message_lines = ["🚀 <b>Новые токены найдены!</b>"]
                         for token_info in all_recent_tokens_info:
-                            try:
-                                # --- Преобразование price_usd в float ---
-                                price_usd_value = token_info.get('price_usd', 0)
-                                if isinstance(price_usd_value, str):
-                                    price_usd_float = float(price_usd_value)
-                                else:
-                                    price_usd_float = float(price_usd_value)
-                                price_usd_formatted = f"{price_usd_float:.6f}"
-                            except (ValueError, TypeError):
-                                logging.warning(f"Невозможно преобразовать цену {token_info.get('price_usd')} в число для токена {token_info.get('address')}. Используется 'N/A'.")
-                                price_usd_formatted = "N/A"
-
-                            message_lines.append(
-                                f"\n 🪙 <b>{token_info.get('name', 'Unknown')} ({token_info.get('symbol', 'UNKNOWN')})</b>\n"
-                                f"📬 Адрес: <code>{token_info.get('address', 'N/A')}</code>\n"
-                                f"💰 Цена: ${price_usd_formatted}\n"
-                                f"🕒 Обнаружен: {token_info.get('discovered_at', 'N/A')}\n"
-                                f"------------------------"
-                            )
-                        # Убираем последний разделитель "---"
-                        if message_lines and message_lines[-1] == "---":
-                            message_lines.pop()
+                            message_lines.append(TOKEN_TPL.format(
+                                name=token_info.get('name', 'Unknown'),
+                                symbol=token_info.get('symbol', 'UNKNOWN'),
+                                address=token_info.get('address', 'N/A'),
+                                price=f"{token_info.get('price_usd', 0.0):.6f}",
+                                discovered_at=token_info.get('discovered_at', 'N/A')
+                            ))
                         message_text = "\n".join(message_lines) + "\n\n#new_tokens #solana #memecoin"
 
                         await bot.send_message(
@@ -315,38 +421,39 @@ async def monitor_new_tokens(bot: Bot):
                     logging.error(f"Ошибка отправки сообщения в группу о новых токенах: {e}")
                 for token_address in new_tokens: 
                     logging.info(f"🚀 Пытаемся купить токен: {token_address}")
-                    wm = WalletManager()
-                    user_config_files = glob.glob('config/wallets/*.json')
-                    for config_file in user_config_files:
-                        try:
-                            user_id = int(os.path.basename(config_file).split('.')[0])
-                            user_wallets = wm.get_user_wallets(user_id)
-                            for wallet_name in user_wallets.keys():
-                                from trader import buy_token
-                                await buy_token(user_id, wallet_name, token_address, bot)
-                        except Exception as e:
-                            logging.error(f"Ошибка обработки пользователя из файла {config_file}: {e}")
             else:
                 logging.info("Новые токены не найдены")
-            wm = WalletManager()
-            user_config_files = glob.glob('config/wallets/*.json')
-            for config_file in user_config_files:
-                try:
-                    user_id = int(os.path.basename(config_file).split('.')[0])
-                    user_wallets = wm.get_user_wallets(user_id)
-                    for wallet_name in user_wallets.keys():
-                        from trader import check_and_sell_tokens
-                        await check_and_sell_tokens(user_id, wallet_name, bot)
-                except Exception as e:
-                    logging.error(f"Ошибка проверки продаж для пользователя из файла {config_file}: {e}")
+            # Один проход по кошелькам: сначала покупки новых токенов, затем проверка продаж.
+            # Блокировка кошелька выдается в порядке постановки задач, поэтому для одного кошелька порядок сохраняется
+            jobs = []
+            for user_id, wallet_names in user_wallet_map.items():
+                for wallet_name in wallet_names:
+                    for token_address in new_tokens:
+                        jobs.append((user_id, wallet_name, token_address))
+                    jobs.append((user_id, wallet_name, None))
+            results = await asyncio.gather(
+                *(
+                    _buy_guarded(user_id, wallet_name, token_address, bot) if token_address
+                    else _check_and_sell_guarded(user_id, wallet_name, bot)
+                    for user_id, wallet_name, token_address in jobs
+                ),
+                return_exceptions=True
+            )
+            for (user_id, wallet_name, token_address), result in zip(jobs, results):
+                if not isinstance(result, Exception):
+                    continue
+                if token_address:
+                    logging.error(f"Ошибка покупки токена {token_address} для {user_id}/{wallet_name}: {result}")
+                else:
+                    logging.error(f"Ошибка проверки продаж для {user_id}/{wallet_name}: {result}")
             check_interval = 15
             logging.info(f"Ожидание {check_interval} секунд перед следующей проверкой...")
-            await asyncio.sleep(check_interval)
+            await _sleep_unless_stopped(check_interval)
         except Exception as e:
             logging.error(f"Ошибка в цикле мониторинга: {e}")
             wait_time = 60 
             logging.info(f"Ожидание {wait_time} секунд перед повторной попыткой...")
-            await asyncio.sleep(wait_time)
+            await _sleep_unless_stopped(wait_time)
 
 async def run_monitor(bot: Bot):
     """Функция для запуска монитора."""
@@ -1,38 +1,396 @@
 # solana_utils.py
+import asyncio
+import io
+import aiohttp
+import ijson
+import orjson
 import requests
+import urllib3
 import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from solana.rpc.api import Client
 from solana.rpc.commitment import Confirmed
 from solders.pubkey import Pubkey
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Полные тела ответов Jupiter пишутся в лог только при SNIPER_TRACE=1
+SNIPER_TRACE = os.environ.get("SNIPER_TRACE") == "1"
 
 SOLANA_RPC_URL = "https://api.mainnet-beta.solana.com"
-JUPITER_QUOTE_URL = "https://quote-api.jup.ag/v6/quote"
-JUPITER_SWAP_URL = "https://quote-api.jup.ag/v6/swap"
+# Адреса Jupiter переопределяются через окружение (платные/зеркальные эндпоинты с большим лимитом).
+# JUPITER_QUOTE_URLS / JUPITER_SWAP_URLS - резервные адреса через запятую, пробуются по порядку при 429/5xx
+JUPITER_QUOTE_URL = os.environ.get("JUPITER_QUOTE_URL", "https://lite-api.jup.ag/swap/v1/quote")
+JUPITER_SWAP_URL = os.environ.get("JUPITER_SWAP_URL", "https://lite-api.jup.ag/swap/v1/swap")
+JUPITER_QUOTE_URLS = [JUPITER_QUOTE_URL] + [u.strip() for u in os.environ.get("JUPITER_QUOTE_URLS", "").split(",") if u.strip()]
+JUPITER_SWAP_URLS = [JUPITER_SWAP_URL] + [u.strip() for u in os.environ.get("JUPITER_SWAP_URLS", "").split(",") if u.strip()]
+# Jupiter Price API v3; price.jup.ag/v6 выведен из эксплуатации
+JUPITER_PRICE_URL = os.environ.get("JUPITER_PRICE_URL", "https://lite-api.jup.ag/price/v3")
+JUPITER_PRICE_BATCH_SIZE = 50  # лимит ids в одном запросе Price API v3
 DEXSCREENER_API_URL = "https://api.dexscreener.com/latest/dex/tokens/"
-JUPITER_MAX_RETRIES = 3
-JUPITER_BACKOFF_FACTOR = 1
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 1
+HTTP_TIMEOUT = (3, 10)  # (connect, read)
+
+# Общая сессия с keep-alive: TLS-рукопожатие с DexScreener/CoinGecko/Jupiter выполняется один раз,
+# а 429 и 5xx повторяются адаптером с экспоненциальной паузой
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+))
+SESSION.headers["Accept-Encoding"] = "gzip"
+
+# Общая асинхронная сессия для горячих путей (Jupiter, RPC). Создается лениво внутри event loop
+_http_session: aiohttp.ClientSession = None
+_http_session_loop = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую aiohttp-сессию текущего event loop, создавая ее при первом обращении."""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30, connect=3),
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300)
+        )
+        _http_session_loop = loop
+    return _http_session
+
+
+async def close_http_session():
+    """Закрывает общую aiohttp-сессию (вызывается при остановке бота)."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнялся: предохранитель сервиса разомкнут."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего API: после fail_max отказов подряд запросы сразу отклоняются
+    с CircuitOpenError на reset_timeout секунд, вместо того чтобы каждый ждал сетевой таймаут.
+    После паузы (полуоткрытое состояние) пропускается ровно один пробный запрос, остальные отклоняются,
+    пока он не завершится: успех замыкает предохранитель, ошибка снова размыкает его на reset_timeout.
+    Если результат пробы так и не записан (запрос отменен), через reset_timeout пропускается новая проба.
+    """
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started_at = None  # время запуска пробного запроса в полуоткрытом состоянии
+        self._lock = threading.Lock()
+
+    def _rejects(self, now: float) -> bool:
+        if self._opened_at is None:
+            return False
+        if now - self._opened_at < self.reset_timeout:
+            return True
+        return self._probe_started_at is not None and now - self._probe_started_at < self.reset_timeout
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._rejects(time.monotonic())
+
+    def before_call(self):
+        """Бросает CircuitOpenError, если предохранитель разомкнут; по истечении паузы пропускает один пробный запрос."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            if self._rejects(now):
+                raise CircuitOpenError(f"{self.name} временно недоступен")
+            self._probe_started_at = now
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_started_at is not None or (self._failures >= self.fail_max and self._opened_at is None):
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+                logger.warning(f"{self.name}: {self._failures} ошибок подряд, запросы приостановлены на {self.reset_timeout} с")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+_DEX_BREAKER = CircuitBreaker("DexScreener")
+_COINGECKO_BREAKER = CircuitBreaker("CoinGecko")
+_JUPITER_BREAKER = CircuitBreaker("Jupiter")
+
+
+# Для горячего пути DexScreener (простые GET в цикле опроса) - urllib3 напрямую,
+# без подготовки запроса, хуков и cookie jar из requests
+_DEX_HTTP = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=32,
+    retries=Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    ),
+    headers={"Accept-Encoding": "gzip"}
+)
+_DEX_HTTP_TIMEOUT = urllib3.Timeout(connect=3, read=10)
+
+
+def _dex_get(url: str) -> urllib3.HTTPResponse:
+    """GET к DexScreener через пул urllib3; 429 и 5xx (после повторов) считаются отказом сервиса."""
+    response = _DEX_HTTP.request("GET", url, timeout=_DEX_HTTP_TIMEOUT)
+    if response.status == 429 or response.status >= 500:
+        raise urllib3.exceptions.HTTPError(f"DexScreener HTTP {response.status}")
+    return response
+
+
+def _checked_get(url: str, **kwargs) -> requests.Response:
+    """GET через общую сессию; 429 и 5xx (после повторов адаптера) считаются отказом сервиса."""
+    response = SESSION.get(url, **kwargs)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+# Ответ DexScreener по токену кэшируется: цена и список DEX быстро устаревают,
+# а имя, символ и время создания пула практически не меняются
+_DEX_CACHE_FAST = TTLCache(maxsize=4096, ttl=15)
+_DEX_CACHE_SLOW = TTLCache(maxsize=4096, ttl=3600)
+_dex_cache_lock = threading.Lock()
+_dex_inflight = {}
+_dex_inflight_lock = threading.Lock()
+# Пул для параллельных запросов по нескольким токенам (работа чисто сетевая, GIL не мешает)
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="dex")
+# Цены токенов в USD (заполняется пакетным запросом к Jupiter и одиночными запросами к DexScreener)
+_PRICE_CACHE = TTLCache(maxsize=4096, ttl=15)
+
+
+class DexInfo:
+    """Ответ DexScreener по токену. Хранит сырые байты, JSON разбирается при первом обращении к pairs."""
+    __slots__ = ("content", "_pairs", "_pairs_by_quote")
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self._pairs = None
+        self._pairs_by_quote = None
+
+    @property
+    def pairs(self) -> list:
+        if self._pairs is None:
+            self._pairs = orjson.loads(self.content).get("pairs") or []
+        return self._pairs
+
+    @property
+    def first_pair(self) -> dict:
+        """
+        Первая пара токена. Если полный список еще не разобран, читает потоково только первый элемент
+        массива pairs - для метаданных и времени создания остальные пулы не нужны.
+        """
+        if self._pairs is not None:
+            return self._pairs[0] if self._pairs else None
+        return next(ijson.items(io.BytesIO(self.content), 'pairs.item', use_float=True), None)
+
+    @property
+    def pairs_by_quote(self) -> dict:
+        """{символ quote-токена в верхнем регистре: первая пара с положительной ценой в USD}."""
+        if self._pairs_by_quote is None:
+            index = {}
+            for pair in self.pairs:
+                quote_symbol = (pair.get("quoteToken") or {}).get("symbol", "").upper()
+                if quote_symbol in index:
+                    continue
+                try:
+                    if float(pair.get("priceUsd") or 0) > 0:
+                        index[quote_symbol] = pair
+                except (TypeError, ValueError):
+                    continue
+            self._pairs_by_quote = index
+        return self._pairs_by_quote
+
+    @property
+    def has_pairs(self) -> bool:
+        if self._pairs is not None:
+            return bool(self._pairs)
+        # Без полного разбора: для неизвестного токена DexScreener отдает "pairs":null
+        return b'"pairs":null' not in self.content and b'"pairs":[]' not in self.content
+
+
+def _validate(token_address: str) -> bool:
+    """Быстрая локальная проверка адреса: некорректная строка не должна стоить сетевого запроса."""
+    try:
+        Pubkey.from_string(token_address)
+        return True
+    except (ValueError, TypeError):
+        logger.warning(f"Некорректный адрес токена: {token_address}")
+        return False
+
+
+def _fetch_dex(token_address: str, fresh: bool = True) -> DexInfo:
+    """
+    Возвращает ответ DexScreener по токену (один HTTP-запрос на все геттеры).
+    fresh=True - данные не старше 15 секунд (цена), fresh=False - до часа (метаданные).
+    При ошибке ответа возвращает None.
+    """
+    cache = _DEX_CACHE_FAST if fresh else _DEX_CACHE_SLOW
+    with _dex_cache_lock:
+        info = cache.get(token_address)
+    if info is not None:
+        return info
+    # Single-flight: пока один поток качает токен, остальные ждут его результат, а не шлют свои запросы
+    with _dex_inflight_lock:
+        future = _dex_inflight.get(token_address)
+        is_owner = future is None
+        if is_owner:
+            future = _dex_inflight[token_address] = Future()
+    if not is_owner:
+        return future.result()
+    try:
+        info = _download_dex(token_address)
+        future.set_result(info)
+        return info
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _dex_inflight_lock:
+            _dex_inflight.pop(token_address, None)
+
+
+def _download_dex(token_address: str) -> DexInfo:
+    response = _DEX_BREAKER.call(_dex_get, DEXSCREENER_API_URL + token_address)
+    if response.status != 200:
+        logger.warning(f"DexScreener вернул статус {response.status} для токена {token_address}")
+        return None
+    info = DexInfo(response.data)
+    with _dex_cache_lock:
+        _DEX_CACHE_FAST[token_address] = info
+        # Пустой ответ в долгий кэш не кладем - у нового токена пул может появиться в любой момент
+        if info.has_pairs:
+            _DEX_CACHE_SLOW[token_address] = info
+    return info
+
+
+# Локальный кэш метаданных: имя/символ/время создания пула почти не меняются,
+# поэтому после перезапуска их не нужно заново запрашивать у DexScreener
+TOKEN_CACHE_DB = 'data/token_cache.sqlite'
+TOKEN_METADATA_TTL = 86400  # секунд; время создания пула хранится бессрочно
+_token_db = None
+_token_db_lock = threading.Lock()
+
+
+def _get_token_db() -> sqlite3.Connection:
+    global _token_db
+    if _token_db is None:
+        os.makedirs(os.path.dirname(TOKEN_CACHE_DB), exist_ok=True)
+        _token_db = sqlite3.connect(TOKEN_CACHE_DB, check_same_thread=False)
+        _token_db.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "addr TEXT PRIMARY KEY, name TEXT, symbol TEXT, logo TEXT, created_at REAL, fetched_at REAL)"
+        )
+    return _token_db
+
+
+def _load_cached_token(token_address: str) -> tuple:
+    """Возвращает (name, symbol, logo, created_at, fetched_at) из локального кэша или None."""
+    try:
+        with _token_db_lock:
+            return _get_token_db().execute(
+                "SELECT name, symbol, logo, created_at, fetched_at FROM tokens WHERE addr = ?",
+                (token_address,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Ошибка чтения кэша токенов: {e}")
+        return None
+
+
+def _store_cached_token(token_address: str, pair: dict):
+    base_token = pair.get("baseToken", {})
+    created_at = pair.get("pairCreatedAt", 0) or 0
+    try:
+        with _token_db_lock:
+            db = _get_token_db()
+            db.execute(
+                "INSERT OR REPLACE INTO tokens (addr, name, symbol, logo, created_at, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    token_address,
+                    base_token.get('name', 'Unknown'),
+                    base_token.get('symbol', 'UNKNOWN'),
+                    base_token.get('logoURI', ''),
+                    created_at / 1000 if created_at > 0 else 0.0,
+                    time.time()
+                )
+            )
+            db.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Ошибка записи кэша токенов: {e}")
+
+
+# Метаданные в памяти поверх SQLite: повторный вызов для того же токена не ходит ни в сеть, ни на диск
+# TTLCache не потокобезопасен, а get_token_metadata вызывается из asyncio.to_thread - доступ под блокировкой
+_METADATA_CACHE = TTLCache(maxsize=10_000, ttl=TOKEN_METADATA_TTL)
+_metadata_lock = threading.Lock()
 
 
 def get_token_metadata(token_address: str) -> dict:
+    if not _validate(token_address):
+        return {"name": "Unknown", "symbol": "UNKNOWN", "decimals": 0, "logoURI": ""}
+    with _metadata_lock:
+        metadata = _METADATA_CACHE.get(token_address)
+    if metadata is not None:
+        return dict(metadata)
+    cached = _load_cached_token(token_address)
+    if cached and time.time() - cached[4] < TOKEN_METADATA_TTL:
+        metadata = {"name": cached[0], "symbol": cached[1], "decimals": 0, "logoURI": cached[2]}
+        with _metadata_lock:
+            _METADATA_CACHE[token_address] = metadata
+        return dict(metadata)
     try:
-        url = f"{DEXSCREENER_API_URL}{token_address}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            pairs = data.get("pairs", [])
-            if pairs:
-                pair = pairs[0]
-                base_token = pair.get("baseToken", {})
-                return {
-                    "name": base_token.get('name', 'Unknown'),
-                    "symbol": base_token.get('symbol', 'UNKNOWN'),
-                    "decimals": 0,
-                    "logoURI": base_token.get('logoURI', '')
-                }
-        logger.warning(f"Не удалось получить метаданные для токена {token_address}. Status: {response.status_code}")
+        info = _fetch_dex(token_address, fresh=False)
+        pair = info.first_pair if info else None
+        if pair:
+            _store_cached_token(token_address, pair)
+            base_token = pair.get("baseToken", {})
+            metadata = {
+                "name": base_token.get('name', 'Unknown'),
+                "symbol": base_token.get('symbol', 'UNKNOWN'),
+                "decimals": 0,
+                "logoURI": base_token.get('logoURI', '')
+            }
+            with _metadata_lock:
+                _METADATA_CACHE[token_address] = metadata
+            return dict(metadata)
+        logger.warning(f"Не удалось получить метаданные для токена {token_address}")
         return {"name": "Unknown", "symbol": "UNKNOWN", "decimals": 0, "logoURI": ""}
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка сети при получении метаданных для {token_address}: {e}")
@@ -41,13 +399,35 @@ def get_token_metadata(token_address: str) -> dict:
         logger.error(f"Ошибка получения метаданных для {token_address}: {e}")
         return {"name": "Unknown", "symbol": "UNKNOWN", "decimals": 0, "logoURI": ""}
 
+SOL_PRICE_TTL = 10  # секунд
+_sol_price_lock = threading.Lock()
+_sol_price_cached = (0.0, 0.0)  # (time.monotonic() получения, цена)
+
+
 def get_sol_usdt_price() -> float:
+    """
+    Цена SOL в USD с кэшем на SOL_PRICE_TTL секунд.
+    Запрос к CoinGecko выполняется под блокировкой: одновременные вызовы ждут один общий запрос
+    вместо того, чтобы упираться в лимит бесплатного API.
+    """
+    global _sol_price_cached
+    with _sol_price_lock:
+        fetched_at, price = _sol_price_cached
+        if price > 0 and time.monotonic() - fetched_at < SOL_PRICE_TTL:
+            return price
+        price = _fetch_sol_usdt_price()
+        if price > 0:
+            _sol_price_cached = (time.monotonic(), price)
+        return price
+
+
+def _fetch_sol_usdt_price() -> float:
     try:
         url = "https://api.coingecko.com/api/v3/simple/price?ids=solana&vs_currencies=usd"
-        response = requests.get(url, timeout=10)
+        response = _COINGECKO_BREAKER.call(_checked_get, url, timeout=HTTP_TIMEOUT)
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             price = data.get('solana', {}).get('usd', 0.0)
             if price > 0:
                 return float(price)
@@ -64,87 +444,163 @@ def get_sol_usdt_price() -> float:
         logger.error(f"Ошибка получения цены SOL в USDT: {e}")
         return 0.0
 
-def get_jupiter_swap_transaction(
-    input_mint: str, 
-    output_mint: str, 
-    amount: int, 
-    slippage: int,
-    user_public_key: str
-) -> dict:
+async def _jupiter_request(session: aiohttp.ClientSession, method: str, urls: list, **kwargs) -> tuple:
     """
-    Получает транзакцию swap от Jupiter API.
+    Выполняет запрос к первому доступному адресу Jupiter из списка.
+    При 429/5xx, сетевой ошибке или таймауте переходит к следующему адресу. Возвращает (status, body).
     """
+    for i, url in enumerate(urls):
+        is_last = i == len(urls) - 1
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                if not is_last and (response.status == 429 or response.status >= 500):
+                    logger.warning(f"Jupiter {url} вернул {response.status}, пробуем резервный адрес")
+                    continue
+                return response.status, body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Истекший ClientTimeout aiohttp поднимает как asyncio.TimeoutError, а не ClientError
+            if is_last:
+                raise
+            logger.warning(f"Jupiter {url} недоступен ({e!r}), пробуем резервный адрес")
+
+
+async def get_jupiter_quote(input_mint: str, output_mint: str, amount: int, slippage: int) -> dict:
+    """Получает котировку Jupiter. Ответ можно переиспользовать в get_jupiter_swap_transaction_fast."""
+    if not _validate(input_mint) or not _validate(output_mint):
+        return None
     try:
-        logger.info(f"DEBUG: get_jupiter_swap_transaction called with:")
-        logger.info(f"  input_mint: {input_mint}")
-        logger.info(f"  output_mint: {output_mint}")
-        logger.info(f"  amount: {amount} (type: {type(amount)})")
-        logger.info(f"  slippage: {slippage}")
-        logger.info(f"  user_public_key: {user_public_key}")
-        amount_in_smallest_units = int(amount)
-        logger.info(f"  amount_in_smallest_units: {amount_in_smallest_units}")
+        session = await get_http_session()
         quote_params = {
             'inputMint': input_mint,
             'outputMint': output_mint,
-            'amount': amount_in_smallest_units,
+            'amount': int(amount),
             'slippageBps': slippage
         }
-        logger.info(f"DEBUG: Sending quote request to {JUPITER_QUOTE_URL} with params: {quote_params}")
-        quote_response = requests.get(JUPITER_QUOTE_URL, params=quote_params, timeout=20)
-        logger.info(f"DEBUG: Quote response status: {quote_response.status_code}")
-        logger.info(f"DEBUG: Quote response headers: {dict(quote_response.headers)}")
-        
-        if quote_response.status_code != 200:
-            logger.error(f"Ошибка получения котировки: {quote_response.status_code} {quote_response.text}")
+        logger.debug("Quote request to %s with params: %s", JUPITER_QUOTE_URL, quote_params)
+        quote_status, quote_body = await _jupiter_request(
+            session, "GET", JUPITER_QUOTE_URLS,
+            params=quote_params, timeout=aiohttp.ClientTimeout(total=20, connect=3)
+        )
+        logger.debug("Quote response status: %s", quote_status)
+        if quote_status != 200:
+            logger.error(f"Ошибка получения котировки: {quote_status} {quote_body.decode(errors='replace')}")
             return None
-            
-        quote_data = quote_response.json()
-        logger.info(f"DEBUG: Quote data received: {quote_data}")
+        quote_data = orjson.loads(quote_body)
+        if SNIPER_TRACE:
+            logger.debug("Quote data received: %s", quote_data)
+        return quote_data
+    except Exception:
+        logger.exception("Ошибка при получении котировки Jupiter")
+        return None
+
+
+async def get_jupiter_swap_transaction_fast(
+    quote_response: dict,
+    user_public_key: str,
+    use_shared_accounts: bool = True,
+    compute_unit_price_micro_lamports: int = None,
+    prioritization_fee_lamports="auto"
+) -> dict:
+    """
+    Строит транзакцию swap по уже полученной котировке - один запрос вместо двух.
+    Используйте, когда у вызывающего кода есть свежая котировка (например, после симуляции).
+    """
+    try:
+        session = await get_http_session()
         swap_params = {
-            'quoteResponse': quote_data,
+            'quoteResponse': quote_response,
             'userPublicKey': user_public_key,
             'wrapAndUnwrapSol': True,
-            'useSharedAccounts': False
+            'dynamicComputeUnitLimit': True,
+            'useSharedAccounts': use_shared_accounts
         }
+        if compute_unit_price_micro_lamports is not None:
+            swap_params['computeUnitPriceMicroLamports'] = compute_unit_price_micro_lamports
+        elif prioritization_fee_lamports is not None:
+            swap_params['prioritizationFeeLamports'] = prioritization_fee_lamports
         
-        logger.info(f"DEBUG: Sending swap request with params: {swap_params}")
-        swap_response = requests.post(JUPITER_SWAP_URL, json=swap_params, timeout=30)
-        logger.info(f"DEBUG: Swap response status: {swap_response.status_code}")
-        logger.info(f"DEBUG: Swap response headers: {dict(swap_response.headers)}")
-        
-        if swap_response.status_code != 200:
-            logger.error(f"Ошибка получения транзакции swap: {swap_response.status_code} {swap_response.text}")
+        if SNIPER_TRACE:
+            logger.debug("Swap request params: %s", swap_params)
+        swap_status, swap_body = await _jupiter_request(
+            session, "POST", JUPITER_SWAP_URLS,
+            data=orjson.dumps(swap_params), headers={"Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=10, connect=3)
+        )
+        logger.debug("Swap response status: %s", swap_status)
+        if swap_status != 200:
+            swap_error_text = swap_body.decode(errors='replace')
+            logger.error(f"Ошибка получения транзакции swap: {swap_status} {swap_error_text}")
             try:
-                error_details = swap_response.json()
-                logger.error(f"DEBUG: Swap error details: {error_details}")
+                error_details = orjson.loads(swap_body)
+                logger.debug("Swap error details: %s", error_details)
             except:
-                logger.error(f"DEBUG: Swap error text: {swap_response.text}")
+                logger.debug("Swap error text: %s", swap_error_text)
             return None
-            
-        swap_data = swap_response.json()
-        logger.info(f"DEBUG: Swap data received: {swap_data}")
+        swap_data = orjson.loads(swap_body)
+        if SNIPER_TRACE:
+            logger.debug("Swap data received: %s", swap_data)
         if 'swapTransaction' not in swap_data:
             logger.error(f"Ключ 'swapTransaction' не найден в ответе Jupiter: {swap_data}")
             return None
         return {"tx": swap_data['swapTransaction']}
-    except Exception as e:
-        logger.error(f"Ошибка при получении транзакции swap: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Ошибка при получении транзакции swap")
         return None
-    
+
+
+async def get_jupiter_swap_transaction(
+    input_mint: str, 
+    output_mint: str, 
+    amount: int, 
+    slippage: int,
+    user_public_key: str,
+    use_shared_accounts: bool = True,
+    compute_unit_price_micro_lamports: int = None,
+    prioritization_fee_lamports="auto"
+) -> dict:
+    """
+    Получает транзакцию swap от Jupiter API (котировка + swap).
+    Асинхронная: несколько токенов можно запрашивать параллельно через asyncio.gather.
+    use_shared_accounts=True дает транзакцию меньшего размера на маршрутах, где это поддерживается;
+    если маршрут общие аккаунты не поддерживает, swap повторяется без них на той же котировке.
+    Приоритетная комиссия: явная цена compute unit (микролампорты) или prioritization_fee_lamports
+    ("auto" - Jupiter подбирает сам); Jupiter не принимает оба параметра одновременно.
+    """
+    logger.debug(
+        "get_jupiter_swap_transaction: %s -> %s, amount=%s, slippage=%s, user=%s",
+        input_mint, output_mint, amount, slippage, user_public_key
+    )
+    quote_data = await get_jupiter_quote(input_mint, output_mint, amount, slippage)
+    if quote_data is None:
+        return None
+    swap_data = await get_jupiter_swap_transaction_fast(
+        quote_data,
+        user_public_key,
+        use_shared_accounts=use_shared_accounts,
+        compute_unit_price_micro_lamports=compute_unit_price_micro_lamports,
+        prioritization_fee_lamports=prioritization_fee_lamports
+    )
+    if swap_data is None and use_shared_accounts:
+        swap_data = await get_jupiter_swap_transaction_fast(
+            quote_data,
+            user_public_key,
+            use_shared_accounts=False,
+            compute_unit_price_micro_lamports=compute_unit_price_micro_lamports,
+            prioritization_fee_lamports=prioritization_fee_lamports
+        )
+    return swap_data
+
+
 def get_token_dex_listings(token_address: str) -> list:
+    if not _validate(token_address):
+        return []
     try:
-        url = f"{DEXSCREENER_API_URL}{token_address}"
-        response = requests.get(url, timeout=10)
-
-        if response.status_code == 200:
-            data = response.json()
-            pairs = data.get("pairs", [])
-            dex_names = [pair.get('dexId', 'Unknown') for pair in pairs]
-            return dex_names
+        info = _fetch_dex(token_address)
+        if info is not None:
+            return [pair.get('dexId', 'Unknown') for pair in info.pairs]
 
-        logger.warning(f"Не удалось получить информацию о DEX для токена {token_address}. Status: {response.status_code}")
+        logger.warning(f"Не удалось получить информацию о DEX для токена {token_address}")
         return []
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка сети при получении списка DEX для {token_address}: {e}")
@@ -153,25 +609,59 @@ def get_token_dex_listings(token_address: str) -> list:
         logger.error(f"Ошибка получения списка DEX для {token_address}: {e}")
         return []
 
+def get_token_prices_usdt(token_addresses: list) -> dict:
+    """
+    Пакетно получает цены токенов в USD через Jupiter Price API (до JUPITER_PRICE_BATCH_SIZE адресов за запрос).
+    Возвращает {адрес: цена}; токены без цены в результат не попадают.
+    Для списка токенов используйте эту функцию вместо get_token_price_usdt в цикле.
+    """
+    prices = {}
+    addresses = [token_address for token_address in dict.fromkeys(token_addresses) if _validate(token_address)]
+    for i in range(0, len(addresses), JUPITER_PRICE_BATCH_SIZE):
+        chunk = addresses[i:i + JUPITER_PRICE_BATCH_SIZE]
+        try:
+            response = _JUPITER_BREAKER.call(
+                _checked_get, JUPITER_PRICE_URL, params={"ids": ",".join(chunk)}, timeout=HTTP_TIMEOUT
+            )
+            if response.status_code != 200:
+                logger.warning(f"Jupiter Price API вернул статус {response.status_code}")
+                continue
+            # Ответ v3 - {адрес: {"usdPrice": ...}}; токенов без цены в нем нет
+            data = orjson.loads(response.content)
+            if not isinstance(data, dict):
+                continue
+            for token_address in chunk:
+                try:
+                    price = float((data.get(token_address) or {}).get("usdPrice") or 0)
+                except (TypeError, ValueError):
+                    continue
+                if price > 0:
+                    prices[token_address] = price
+        except Exception as e:
+            logger.error(f"Ошибка пакетного получения цен через Jupiter: {e}")
+    if prices:
+        with _dex_cache_lock:
+            _PRICE_CACHE.update(prices)
+    return prices
+
+
 def get_token_price_usdt(token_address: str) -> float:
+    if not _validate(token_address):
+        return 0.0
+    with _dex_cache_lock:
+        cached_price = _PRICE_CACHE.get(token_address)
+    if cached_price:
+        return cached_price
     try:
-        url = f"{DEXSCREENER_API_URL}{token_address}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            pairs = data.get("pairs", [])
-            for pair in pairs:
-                quote_token = pair.get("quoteToken", {})
-                if quote_token.get("symbol", "").upper() == "SOL":
-                    price_usd = pair.get("priceUsd", "0")
-                    try:
-                        price_float = float(price_usd)
-                        if price_float > 0:
-                            return price_float
-                    except (TypeError, ValueError):
-                        continue
-
-        logger.warning(f"Не удалось получить текущую цену для токена {token_address} через DexScreener. Status: {response.status_code}")
+        info = _fetch_dex(token_address)
+        sol_pair = info.pairs_by_quote.get("SOL") if info else None
+        if sol_pair:
+            price_float = float(sol_pair["priceUsd"])
+            with _dex_cache_lock:
+                _PRICE_CACHE[token_address] = price_float
+            return price_float
+
+        logger.warning(f"Не удалось получить текущую цену для токена {token_address} через DexScreener")
         return 0.0
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка сети при получении цены токена {token_address} в USDT: {e}")
@@ -181,19 +671,21 @@ def get_token_price_usdt(token_address: str) -> float:
         return 0.0
 
 def get_token_creation_time(token_address: str) -> float:
+    if not _validate(token_address):
+        return 0.0
+    cached = _load_cached_token(token_address)
+    if cached and cached[3] > 0:
+        return cached[3]
     try:
-        url = f"{DEXSCREENER_API_URL}{token_address}"
-        response = requests.get(url, timeout=10)
+        info = _fetch_dex(token_address, fresh=False)
+        pair = info.first_pair if info else None
+        if pair:
+            _store_cached_token(token_address, pair)
+            created_at = pair.get("pairCreatedAt", 0)
+            if created_at > 0:
+                return created_at / 1000  
 
-        if response.status_code == 200:
-            data = response.json()
-            pairs = data.get("pairs", [])
-            if pairs:
-                created_at = pairs[0].get("pairCreatedAt", 0)
-                if created_at > 0:
-                    return created_at / 1000  
-
-        logger.warning(f"Не удалось получить время создания для токена {token_address}. Status: {response.status_code}")
+        logger.warning(f"Не удалось получить время создания для токена {token_address}")
         return 0.0
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка сети при получении времени создания для {token_address}: {e}")
@@ -201,3 +693,23 @@ def get_token_creation_time(token_address: str) -> float:
     except Exception as e:
         logger.error(f"Ошибка при получении времени создания для {token_address}: {e}")
         return 0.0
+
+def get_token_full_info(token_address: str) -> dict:
+    """Метаданные, цена, время создания и список DEX токена за один запрос к DexScreener."""
+    # Прогреваем кэш одним запросом - дальше все геттеры читают из него
+    try:
+        _fetch_dex(token_address)
+    except Exception as e:
+        logger.error(f"Ошибка получения данных DexScreener для {token_address}: {e}")
+    return {
+        "address": token_address,
+        "metadata": get_token_metadata(token_address),
+        "price_usd": get_token_price_usdt(token_address),
+        "created_at": get_token_creation_time(token_address),
+        "dexes": get_token_dex_listings(token_address)
+    }
+
+
+def get_many_token_info(token_addresses: list) -> list:
+    """Параллельно собирает get_token_full_info для списка токенов через общий пул потоков."""
+    return list(_EXECUTOR.map(get_token_full_info, token_addresses))
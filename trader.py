@@ -1,119 +1,384 @@
 #trader.py
 
 import base64
+import binascii
+import bisect
 import logging
-import json
+import math
 import os
 import time
-import re
 import asyncio
-import base58
-import requests
+import functools
+import aiohttp
+import orjson
+from cachetools import TTLCache
 from solana.rpc.commitment import Confirmed
-from solana.rpc.types import TokenAccountOpts
-from solders.pubkey import Pubkey
-from solders.keypair import Keypair
 from solders.transaction import VersionedTransaction
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from wallet_manager import WalletManager
 from filters import check_liquidity_and_sellability, is_potential_scam, send_token_analysis_to_group
-from solana_utils import get_sol_usdt_price, get_token_price_usdt, get_token_metadata
+from solana_utils import get_sol_usdt_price, get_token_price_usdt, get_token_prices_usdt, get_token_metadata, get_http_session, get_jupiter_swap_transaction, CircuitBreaker
 from aiogram import Bot
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 GROUP_CHAT_ID = "-1003071618300"
 TOPIC_MESSAGE_THREAD_ID = 61
 SOLANA_RPC_URL = "https://api.mainnet-beta.solana.com"
+# Список RPC через запятую; транзакции отправляются сразу на несколько узлов (хеджирование)
+SOLANA_RPC_URLS = [url.strip() for url in os.getenv("SOLANA_RPC_URLS", SOLANA_RPC_URL).split(",") if url.strip()]
+RPC_HEDGE_DELAY = 0.15  # секунд между запуском запросов к следующему узлу
+_RPC_BREAKERS = {url: CircuitBreaker(f"RPC {url}", fail_max=3, reset_timeout=30) for url in SOLANA_RPC_URLS}
 PURCHASED_TOKENS_DIR = 'data/purchased_tokens'
 url_pay = "https://t.me/KosmoNavt001"
 
+# WalletManager сам кэширует разобранные конфиги до изменения файла, отдельный кэш здесь не нужен
+_WM = WalletManager()
+
 def get_user_config(user_id: int, wallet_name: str) -> dict:
-    wm = WalletManager()
-    return wm.get_wallet_config(user_id, wallet_name)
+    return _WM.get_wallet_config(user_id, wallet_name)
 
-async def get_token_current_price(token_address: str) -> float:
+_background_tasks = set()  # сильные ссылки, чтобы фоновые задачи не собрал GC до завершения
+
+async def _log_errors(coro, error_message: str):
     try:
-        url = f"https://api.dexscreener.com/latest/dex/tokens/{token_address}"
-        response = requests.get(url, timeout=10)
+        await coro
+    except Exception as e:
+        logger.error(f"{error_message}: {e}")
+
+def _spawn(coro, error_message: str):
+    """Запускает корутину в фоне; ошибки только логируются."""
+    task = asyncio.create_task(_log_errors(coro, error_message))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _notify(bot: Bot, chat_id, text: str, **kwargs):
+    """Уведомление в Telegram без ожидания ответа: сделка не ждет round-trip до API Telegram."""
+    _spawn(bot.send_message(chat_id, text, **kwargs), f"Ошибка отправки уведомления пользователю {chat_id}")
+
+PRICE_CACHE_TTL = 3  # секунд
+# Ограниченный TTLCache: устаревшие цены удаляются сами, и кэш не растет с каждым новым токеном
+_price_cache = TTLCache(maxsize=10_000, ttl=PRICE_CACHE_TTL)  # {адрес: цена}
 
-        if response.status_code == 200:
-            data = response.json()
+def _get_cached_price(token_address: str) -> float:
+    return _price_cache.get(token_address)
+
+def _cache_price(token_address: str, price: float):
+    if price > 0:
+        _price_cache[token_address] = price
+
+async def get_token_current_price(token_address: str) -> float:
+    """Текущая цена токена в USD. Результат кэшируется на PRICE_CACHE_TTL секунд: покупка, проверка продаж
+    и просмотр портфеля в одном цикле не повторяют запрос к DexScreener."""
+    cached_price = _get_cached_price(token_address)
+    if cached_price is not None:
+        return cached_price
+    # Одновременные промахи по одному токену ждут один общий запрос, а не идут в DexScreener каждый
+    task = _price_inflight.get(token_address)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_cache_price(token_address))
+        _price_inflight[token_address] = task
+        task.add_done_callback(lambda _: _price_inflight.pop(token_address, None))
+    return await asyncio.shield(task)
+
+_price_inflight = {}  # {адрес: asyncio.Task} - запросы цены, которые уже выполняются
+
+async def _fetch_and_cache_price(token_address: str) -> float:
+    price = await _fetch_token_current_price(token_address)
+    _cache_price(token_address, price)
+    return price
+
+# Написания символа SOL (и обернутого WSOL) в quoteToken у DexScreener; проверка по множеству вместо upper() на каждой паре
+SOL_QUOTE_SYMBOLS = frozenset(("SOL", "Sol", "sol", "WSOL", "wSOL"))
+DEXSCREENER_BATCH_URL = "https://api.dexscreener.com/tokens/v1/solana/"
+
+async def _fetch_token_current_price(token_address: str) -> float:
+    try:
+        # /tokens/v1/solana отдает только пары сети Solana - ответ меньше, чем у /latest/dex/tokens со всеми сетями
+        url = DEXSCREENER_BATCH_URL + token_address
+        session = await get_http_session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            status = response.status
+            data = orjson.loads(await response.read()) if status == 200 else None
+
+        if status == 200:
+            # /tokens/v1 отдает список пар; словарь {"pairs": ...} - формат старого эндпоинта
             if isinstance(data, list):
                 pairs = data
-            elif isinstance(data, dict) and "pairs" in data:
-                pairs = data["pairs"]
             else:
-                logger.warning(f"Неожиданный формат данных от DexScreener для {token_address}: {type(data)}")
-                pairs = []
+                pairs = (data.get("pairs") if isinstance(data, dict) else None) or []
 
+            # Первая пара к SOL с разбираемой ценой; пара с некорректным priceUsd пропускается, а не обрывает поиск
             for pair in pairs:
-                quote_token = pair.get("quoteToken", {})
-                if quote_token.get("symbol", "").upper() == "SOL":
-                    price_usd = pair.get("priceUsd", "0")
-                    try:
-                        return float(price_usd)
-                    except (TypeError, ValueError):
-                        continue
+                quote_token = pair.get("quoteToken")
+                if not quote_token or quote_token.get("symbol") not in SOL_QUOTE_SYMBOLS:
+                    continue
+                try:
+                    return float(pair["priceUsd"])
+                except (KeyError, TypeError, ValueError):
+                    continue
 
             logger.warning(f"Не найдена пара SOL для токена {token_address} через DexScreener.")
-            return get_token_price_usdt(token_address)
+            return await asyncio.to_thread(get_token_price_usdt, token_address)
 
-        logger.warning(f"Не удалось получить текущую цену для токена {token_address} через DexScreener. Status: {response.status_code}")
+        logger.warning(f"Не удалось получить текущую цену для токена {token_address} через DexScreener. Status: {status}")
         return 0.0
-    except requests.exceptions.RequestException as e:
+    except aiohttp.ClientError as e:
         logger.error(f"Ошибка сети при получении текущей цены для {token_address}: {e}")
         return 0.0
     except Exception as e:
         logger.error(f"Ошибка получения текущей цены для {token_address}: {e}")
         return 0.0
 
+PRICE_FETCH_CONCURRENCY = 10
+DEXSCREENER_BATCH_SIZE = 30  # лимит адресов в одном запросе /tokens/v1
+
+async def get_current_prices(token_addresses) -> dict:
+    """Параллельно получает текущие цены токенов: {адрес: цена}. Одновременно не более PRICE_FETCH_CONCURRENCY запросов."""
+    semaphore = asyncio.Semaphore(PRICE_FETCH_CONCURRENCY)
+
+    async def fetch(token_address: str):
+        async with semaphore:
+            return token_address, await get_token_current_price(token_address)
+
+    return dict(await asyncio.gather(*(fetch(token_address) for token_address in token_addresses)))
+
+async def _fetch_prices_batch(session: aiohttp.ClientSession, chunk: list) -> dict:
+    """Один запрос DexScreener на группу токенов; цена берется из первой пары к SOL."""
+    prices = {}
+    try:
+        async with session.get(DEXSCREENER_BATCH_URL + ",".join(chunk), timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status != 200:
+                logger.warning(f"DexScreener batch вернул статус {response.status}")
+                return prices
+            pairs = orjson.loads(await response.read())
+        # Из каждой пары нужны только три поля; разбор заканчивается, как только цена найдена для всех токенов группы
+        wanted = set(chunk)
+        for pair in pairs or ():
+            quote_token = pair.get("quoteToken")
+            if not quote_token or quote_token.get("symbol") not in SOL_QUOTE_SYMBOLS:
+                continue
+            base_token = pair.get("baseToken")
+            token_address = base_token.get("address") if base_token else None
+            if token_address not in wanted:
+                continue
+            try:
+                prices[token_address] = float(pair.get("priceUsd", "0"))
+            except (TypeError, ValueError):
+                continue
+            wanted.discard(token_address)
+            if not wanted:
+                break
+    except Exception as e:
+        logger.error(f"Ошибка пакетного получения цен DexScreener: {e}")
+    return prices
+
+async def get_token_current_prices(token_addresses) -> dict:
+    """
+    Текущие цены портфеля: {адрес: цена}. Сначала Jupiter Price API (до 50 токенов в запросе), остальные -
+    группами по DEXSCREENER_BATCH_SIZE через DexScreener; для токенов без пары к SOL - поштучный запрос.
+    """
+    prices = {}
+    to_fetch = []
+    for token_address in token_addresses:
+        cached_price = _get_cached_price(token_address)
+        if cached_price is not None:
+            prices[token_address] = cached_price
+        else:
+            to_fetch.append(token_address)
+    if not to_fetch:
+        return prices
+    jupiter_prices = await asyncio.to_thread(get_token_prices_usdt, to_fetch)
+    for token_address, price in jupiter_prices.items():
+        _cache_price(token_address, price)
+    prices.update(jupiter_prices)
+    to_fetch = [token_address for token_address in to_fetch if token_address not in jupiter_prices]
+    if not to_fetch:
+        return prices
+    session = await get_http_session()
+    chunks = [to_fetch[i:i + DEXSCREENER_BATCH_SIZE] for i in range(0, len(to_fetch), DEXSCREENER_BATCH_SIZE)]
+    for chunk_prices in await asyncio.gather(*(_fetch_prices_batch(session, chunk) for chunk in chunks)):
+        for token_address, price in chunk_prices.items():
+            _cache_price(token_address, price)
+        prices.update(chunk_prices)
+    missing = [token_address for token_address in to_fetch if token_address not in prices]
+    if missing:
+        prices.update(await get_current_prices(missing))
+    return prices
+
+# Купленные токены кошелька: снимок {user_id}_{wallet}.json и журнал изменений {user_id}_{wallet}.log.
+# Покупка и продажа дописывают в журнал одну строку вместо перезаписи всего файла;
+# когда журнал вырастает, он сворачивается в новый снимок.
+PURCHASED_TOKENS_LOG_COMPACT_BYTES = 64 * 1024
+
+@functools.lru_cache(maxsize=1024)
+def _purchased_tokens_paths(user_id: int, wallet_name: str) -> tuple:
+    """Пути к снимку, журналу и состоянию последней проверки кошелька; вычисляются один раз на кошелек."""
+    base_path = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}")
+    return base_path + ".json", base_path + ".log", base_path + "_last_check.json"
+
+_purchased_tokens_cache = {}  # {(user_id, wallet_name): (сигнатура файлов, {адрес: данные})}
+
+def _files_signature(paths) -> tuple:
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_purchased_tokens(user_id: int, wallet_name: str) -> dict:
+    """
+    Возвращает {адрес токена: данные покупки}: снимок с примененным поверх журналом.
+    Разобранные данные держатся в памяти и перечитываются с диска, только если файлы изменились.
+    Вызывающий получает копию и может ее менять.
+    """
+    snapshot_file, log_file, _ = _purchased_tokens_paths(user_id, wallet_name)
+    cache_key = (user_id, wallet_name)
+    signature = _files_signature((snapshot_file, log_file))
+    cached = _purchased_tokens_cache.get(cache_key)
+    if cached and cached[0] == signature:
+        purchased_tokens = cached[1]
+    else:
+        purchased_tokens = _read_purchased_tokens(snapshot_file, log_file)
+        _purchased_tokens_cache[cache_key] = (signature, purchased_tokens)
+    return {token_address: dict(token_data) for token_address, token_data in purchased_tokens.items()}
+
+def _read_purchased_tokens(snapshot_file: str, log_file: str) -> dict:
+    purchased_tokens = {}
+    if os.path.exists(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as f:
+                purchased_tokens = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            logger.warning(f"Ошибка чтения файла {snapshot_file}, используется только журнал.")
+    if os.path.exists(log_file):
+        with open(log_file, 'rb') as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # недописанная строка после сбоя
+                if entry.get("data") is None:
+                    purchased_tokens.pop(entry["token"], None)
+                else:
+                    purchased_tokens[entry["token"]] = entry["data"]
+    return purchased_tokens
+
+def _append_purchased_tokens_log(user_id: int, wallet_name: str, entries: list):
+    snapshot_file, log_file, _ = _purchased_tokens_paths(user_id, wallet_name)
+    cache_key = (user_id, wallet_name)
+    cached = _purchased_tokens_cache.get(cache_key)
+    cache_is_fresh = cached is not None and cached[0] == _files_signature((snapshot_file, log_file))
+    os.makedirs(PURCHASED_TOKENS_DIR, exist_ok=True)
+    with open(log_file, 'ab') as f:
+        f.write(b"".join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries))
+    if os.path.getsize(log_file) > PURCHASED_TOKENS_LOG_COMPACT_BYTES:
+        _compact_purchased_tokens(user_id, wallet_name)
+    if cache_is_fresh:
+        # Применяем записанное к данным в памяти, чтобы следующее чтение не разбирало файлы заново
+        purchased_tokens = cached[1]
+        for entry in entries:
+            if entry["data"] is None:
+                purchased_tokens.pop(entry["token"], None)
+            else:
+                purchased_tokens[entry["token"]] = entry["data"]
+        _purchased_tokens_cache[cache_key] = (_files_signature((snapshot_file, log_file)), purchased_tokens)
+    else:
+        _purchased_tokens_cache.pop(cache_key, None)
+
+def _atomic_write_json(path: str, data):
+    """Пишет JSON во временный файл и подменяет им path: при сбое на диске остается либо старая, либо новая версия."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, path)
+
+def _compact_purchased_tokens(user_id: int, wallet_name: str):
+    """Сворачивает журнал в снимок. Снимок заменяется атомарно; повторное применение журнала безопасно."""
+    snapshot_file, log_file, _ = _purchased_tokens_paths(user_id, wallet_name)
+    _atomic_write_json(snapshot_file, load_purchased_tokens(user_id, wallet_name))
+    os.remove(log_file)
+
+def save_purchased_token(user_id: int, wallet_name: str, token_address: str, token_data: dict):
+    _append_purchased_tokens_log(user_id, wallet_name, [{"token": token_address, "data": token_data}])
+
+def remove_purchased_tokens(user_id: int, wallet_name: str, token_addresses):
+    _append_purchased_tokens_log(user_id, wallet_name, [{"token": token_address, "data": None} for token_address in token_addresses])
+    token_addresses = set(token_addresses)
+    _drop_new_tokens(lambda token_address, token_data: token_address in token_addresses
+                     and _is_wallet_token(token_data, user_id, wallet_name))
+
+def delete_purchased_tokens(user_id: int, wallet_name: str):
+    """Удаляет все данные о купленных токенах кошелька (при удалении кошелька)."""
+    _purchased_tokens_cache.pop((user_id, wallet_name), None)
+    for path in _purchased_tokens_paths(user_id, wallet_name):
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Удален файл купленных токенов: {path}")
+    _drop_new_tokens(lambda token_address, token_data: _is_wallet_token(token_data, user_id, wallet_name))
+
+# Пороги множителя и статусы между ними: STATUS_LABELS[bisect_right(STATUS_THRESHOLDS, multiplier)].
+# Второй порог - ближайшее число после 1.0, поэтому ровно 1.0 получает отдельный статус без проверки на равенство.
+STATUS_THRESHOLDS = (1.0, math.nextafter(1.0, math.inf), 1.1, 1.2, 1.5, 2, 3, 4)
+STATUS_LABELS = (
+    "🔴 <1.0",
+    "⚪ 1.0",
+    "🟡 >1.0",
+    "🟡 x1.1",
+    "🟡 x1.2",
+    "🟡 x1.5",
+    "🟢 x2+ (Цель достигнута)",
+    "🟢 x3+ (Цель достигнута)",
+    "🟢 x4+ (Цель достигнута)",
+)
+
+def _token_status(purchase_price: float, current_price: float) -> tuple:
+    """Прибыль в %, множитель и статус токена по цене покупки и текущей цене."""
+    if purchase_price > 0:
+        multiplier = current_price / purchase_price
+        profit_percent = (multiplier - 1) * 100
+    else:
+        multiplier = profit_percent = 0
+
+    status = STATUS_LABELS[bisect.bisect_right(STATUS_THRESHOLDS, multiplier)]
+    return profit_percent, multiplier, status
+
+# Уведомления о росте новых токенов: TIER_ALERT_TEMPLATES[i] - шаблон для порога TIER_THRESHOLDS[i];
+# эмодзи и подпись уровня подставлены заранее, при отправке остается один format_map
+TIER_THRESHOLDS = (2, 3, 4)
+TIER_ALERT_TEMPLATES = tuple(
+    f"{emoji} Токен <b>{{name}} ({{symbol}})</b> достиг {label}!\n"
+    "📈 Текущая цена: <b>{price:.6f} USDT</b>\n"
+    "💰 Прибыль: <b>+{profit:.2f}%</b> (x{multiplier:.2f})"
+    for emoji, label in (("🟡", "x2"), ("🟢", "x3"), ("🚀", "x4"))
+)
+
 async def get_purchased_tokens_info(user_id: int, wallet_name: str) -> list:
-    purchased_tokens_file = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}.json")
     tokens_info = []
 
-    if not os.path.exists(purchased_tokens_file):
-        return tokens_info
-
     try:
-        with open(purchased_tokens_file, 'r') as f:
-            purchased_tokens = json.load(f)
+        purchased_tokens = load_purchased_tokens(user_id, wallet_name)
+        if not purchased_tokens:
+            return tokens_info
 
+        current_prices = await get_token_current_prices(purchased_tokens)
         for token_address, token_data in purchased_tokens.items():
-            current_price = await get_token_current_price(token_address)
+            current_price = current_prices[token_address]
 
             if current_price <= 0:
-                logger.warning(f"Не удалось получить текущую цену для токена {token_address}")
+                logger.warning("Не удалось получить текущую цену для токена %s", token_address)
                 continue
 
             purchase_price = token_data.get('purchase_price_usdt', 0)
 
             if purchase_price <= 0:
-                logger.warning(f"Цена покупки для токена {token_address} некорректна: {purchase_price}")
+                logger.warning("Цена покупки для токена %s некорректна: %s", token_address, purchase_price)
                 continue
 
-            profit_percent = ((current_price - purchase_price) / purchase_price) * 100 if purchase_price > 0 else 0
-            multiplier = current_price / purchase_price if purchase_price > 0 else 0
-
-            status = "🔴"
-            if multiplier >= 4:
-                status = "🟢 x4+ (Цель достигнута)"
-            elif multiplier >= 3:
-                status = "🟢 x3+ (Цель достигнута)"
-            elif multiplier >= 2:
-                status = "🟢 x2+ (Цель достигнута)"
-            elif multiplier >= 1.5:
-                status = "🟡 x1.5"
-            elif multiplier >= 1.2:
-                status = "🟡 x1.2"
-            elif multiplier >= 1.1:
-                status = "🟡 x1.1"
-            elif multiplier > 1.0:
-                status = "🟡 >1.0"
-            elif multiplier == 1.0:
-                status = "⚪ 1.0"
-            else:
-                status = "🔴 <1.0"
+            profit_percent, multiplier, status = _token_status(purchase_price, current_price)
 
             tokens_info.append({
                 "address": token_address,
@@ -128,88 +393,103 @@ async def get_purchased_tokens_info(user_id: int, wallet_name: str) -> list:
                 "tx_signature": token_data.get('tx_signature', '')
             })
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON из файла {purchased_tokens_file}: {e}")
     except Exception as e:
-        logger.error(f"Ошибка при получении информации о купленных токенах из {purchased_tokens_file}: {e}")
+        logger.error(f"Ошибка при получении информации о купленных токенах для {user_id}/{wallet_name}: {e}")
 
     return tokens_info
 
+_B64_WHITESPACE = str.maketrans("", "", " \t\r\n")
+
 def decode_jupiter_transaction(tx_data: str) -> bytes:
+    """
+    Декодирует swapTransaction от Jupiter. Jupiter отдает канонический base64, поэтому сначала строгое
+    декодирование без подготовки строки; только при ошибке убираются пробельные символы и дописывается паддинг.
+    """
     try:
-        cleaned_data = tx_data.strip().replace('\n', '').replace(' ', '').replace('=', '')
-        
-        padding = len(cleaned_data) % 4
-        if padding:
-            cleaned_data += '=' * (4 - padding)
-        
-        decoded = base64.b64decode(cleaned_data)
-        logger.info(f"Успешно декодировано {len(decoded)} байт транзакции")
-        return decoded
-        
-    except Exception as e:
-        logger.error(f"Ошибка декодирования транзакции: {e}")
-        try:
-            base64_pattern = r'[A-Za-z0-9+/]+={0,2}'
-            matches = re.findall(base64_pattern, tx_data)
-            if matches:
-                cleaned = ''.join(matches)
-                padding = len(cleaned) % 4
-                if padding:
-                    cleaned += '=' * (4 - padding)
-                return base64.b64decode(cleaned)
-            raise ValueError("No valid base64 found in transaction data")
-        except Exception as e2:
-            logger.error(f"Альтернативный метод декодирования также не удался: {e2}")
-            raise
-
-def get_jupiter_swap_transaction_improved(input_mint: str, output_mint: str, amount: int,
-                                        slippage: int, user_public_key: str) -> dict:
-    try:
-        quote_url = f"https://lite-api.jup.ag/swap/v1/quote?inputMint={input_mint}&outputMint={output_mint}&amount={amount}&slippageBps={slippage}"
-        quote_response = requests.get(quote_url, timeout=10)
-
-        if quote_response.status_code != 200:
-            logger.error(f"Ошибка получения quote: {quote_response.status_code}")
-            return None
-
-        quote_data = quote_response.json()
+        return base64.b64decode(tx_data, validate=True)
+    except binascii.Error:
+        tx_data = tx_data.translate(_B64_WHITESPACE)
+        tx_data += '=' * (-len(tx_data) % 4)
+        return base64.b64decode(tx_data, validate=True)
 
-        swap_payload = {
-            "userPublicKey": user_public_key,
-            "quoteResponse": quote_data,
-            "wrapAndUnwrapSol": True,
-            "dynamicComputeUnitLimit": True,
-            "useSharedAccounts": False,
-        }
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-        swap_response = requests.post("https://lite-api.jup.ag/swap/v1/swap", json=swap_payload, headers=headers, timeout=10)
-
-        if swap_response.status_code != 200:
-            swap_payload["useSharedAccounts"] = True
-            swap_response = requests.post("https://lite-api.jup.ag/swap/v1/swap", json=swap_payload, headers=headers, timeout=10)
+async def _post_rpc(rpc_url: str, payload: dict, timeout: float = 30) -> dict:
+    """
+    POST JSON-RPC запроса на один узел. Ответы 429/5xx и сетевые ошибки учитываются
+    предохранителем узла: после нескольких отказов подряд узел пропускается 30 секунд.
+    """
+    breaker = _RPC_BREAKERS.get(rpc_url)
+    if breaker:
+        breaker.before_call()
+    session = await get_http_session()
+    try:
+        async with session.post(rpc_url, data=orjson.dumps(payload), headers={'Content-Type': 'application/json'},
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            body = await response.read()
+            status = response.status
+        if status == 429 or status >= 500:
+            raise Exception(f"RPC request failed with status {status}: {body[:200]!r}")
+    except Exception:
+        if breaker:
+            breaker.record_failure()
+        raise
+    if breaker:
+        breaker.record_success()
+    if status != 200:
+        raise Exception(f"RPC request failed with status {status}: {body[:200]!r}")
+    return orjson.loads(body)
+
+async def _rpc(method: str, params: list, timeout: float = 10) -> dict:
+    """
+    Общая точка чтения из Solana RPC: запрос идет на первый исправный узел из SOLANA_RPC_URLS,
+    при отказе - на следующий. Соединения переиспользуются через общую aiohttp-сессию.
+    """
+    return await _rpc_send({"jsonrpc": "2.0", "id": 1, "method": method, "params": params}, timeout)
 
-        if swap_response.status_code != 200:
-            logger.error(f"Ошибка получения swap транзакции: {swap_response.status_code}")
-            logger.error(f"Response: {swap_response.text}")
-            return None
+async def _rpc_send(payload, timeout: float = 10):
+    """Отправляет готовое тело JSON-RPC (один запрос или пакет-список) на первый исправный узел."""
+    rpc_urls = [url for url in SOLANA_RPC_URLS if not _RPC_BREAKERS[url].is_open()] or SOLANA_RPC_URLS
+    last_error = None
+    for rpc_url in rpc_urls:
+        try:
+            return await _post_rpc(rpc_url, payload, timeout=timeout)
+        except Exception as e:
+            last_error = e
+    raise last_error
 
-        return swap_response.json()
+async def get_wallet_balance(wallet_address: str) -> float:
+    """Баланс кошелька в SOL через общую aiohttp-сессию (асинхронный аналог WalletManager.get_wallet_balance_solana)."""
+    try:
+        result = await _rpc("getBalance", [wallet_address])
+        if "result" in result and "value" in result["result"]:
+            return round(result["result"]["value"] / 1_000_000_000, 6)
+        logger.error(f"Ошибка в ответе RPC для {wallet_address}: {result}")
+    except Exception as e:
+        logger.error(f"Ошибка получения баланса для {wallet_address}: {e}")
+    return 0.0
 
+async def get_wallet_balances(wallet_addresses) -> dict:
+    """
+    Балансы нескольких кошельков в SOL одним пакетным JSON-RPC запросом: {адрес: баланс}.
+    Кошельки, для которых узел вернул ошибку, получают 0.0.
+    """
+    wallet_addresses = list(dict.fromkeys(address for address in wallet_addresses if address))
+    if not wallet_addresses:
+        return {}
+    balances = dict.fromkeys(wallet_addresses, 0.0)
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": "getBalance", "params": [address]}
+        for i, address in enumerate(wallet_addresses)
+    ]
+    try:
+        for item in await _rpc_send(payload):
+            value = (item.get("result") or {}).get("value")
+            if value is not None:
+                balances[wallet_addresses[item["id"]]] = round(value / 1_000_000_000, 6)
     except Exception as e:
-        logger.error(f"Ошибка в функции получения транзакции свопа: {e}")
-        return None
-       
-def get_jupiter_swap_transaction(input_mint: str, output_mint: str, amount: int, 
-                               slippage: int, user_public_key: str) -> dict:
-    return get_jupiter_swap_transaction_improved(input_mint, output_mint, amount, 
-                                               slippage, user_public_key)
-
-def send_raw_transaction_via_rpc(raw_transaction_bytes: bytes, rpc_url: str, config: dict = None):
+        logger.error(f"Ошибка пакетного получения балансов: {e}")
+    return balances
+
+async def send_raw_transaction_via_rpc(raw_transaction_bytes: bytes, rpc_url: str, config: dict = None):
     """
     Отправляет подписанную транзакцию в кластер Solana через RPC метод sendTransaction.
 
@@ -241,16 +521,7 @@ def send_raw_transaction_via_rpc(raw_transaction_bytes: bytes, rpc_url: str, con
         "params": params
     }
 
-    # Отправляем POST-запрос
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.post(rpc_url, json=payload, headers=headers, timeout=30)
-
-    if response.status_code != 200:
-        raise Exception(f"RPC request failed with status {response.status_code}: {response.text}")
-
-    response_json = response.json()
+    response_json = await _post_rpc(rpc_url, payload)
 
     if "error" in response_json:
         error_message = response_json["error"].get("message", "Unknown error")
@@ -261,33 +532,123 @@ def send_raw_transaction_via_rpc(raw_transaction_bytes: bytes, rpc_url: str, con
 
     return response_json["result"]
 
+async def send_raw_transaction_hedged(raw_transaction_bytes: bytes, config: dict = None) -> str:
+    """
+    Отправляет транзакцию на все доступные узлы из SOLANA_RPC_URLS с задержкой RPC_HEDGE_DELAY
+    между ними и возвращает первую успешную подпись. Повторная отправка той же подписанной
+    транзакции безопасна: сеть исполнит ее один раз.
+    """
+    rpc_urls = [url for url in SOLANA_RPC_URLS if not _RPC_BREAKERS[url].is_open()] or SOLANA_RPC_URLS
+
+    async def attempt(index: int, rpc_url: str) -> str:
+        if index:
+            await asyncio.sleep(RPC_HEDGE_DELAY * index)
+        return await send_raw_transaction_via_rpc(raw_transaction_bytes, rpc_url, config)
+
+    tasks = [asyncio.create_task(attempt(i, url)) for i, url in enumerate(rpc_urls)]
+    last_error = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                return await next_done
+            except Exception as e:
+                logger.warning(f"Отправка транзакции через RPC не удалась: {e}")
+                last_error = e
+    finally:
+        for task in tasks:
+            task.cancel()
+    raise last_error
+
+CONFIRM_POLL_MIN = 0.25  # секунд
+CONFIRM_POLL_MAX = 2.0  # секунд
+
+async def wait_for_confirmation(tx_sig: str, timeout: float = 70) -> bool:
+    """Опрашивает getSignatureStatuses, пока транзакция не получит статус confirmed/finalized или не истечет timeout.
+
+    Первые опросы идут часто (CONFIRM_POLL_MIN), затем интервал удваивается до CONFIRM_POLL_MAX.
+    """
+    async def _poll() -> bool:
+        delay = CONFIRM_POLL_MIN
+        while True:
+            try:
+                status_data = await _rpc("getSignatureStatuses", [[tx_sig]])
+                if "result" in status_data and "value" in status_data["result"]:
+                    sig_status = status_data["result"]["value"][0]
+                    if sig_status is not None and sig_status["confirmationStatus"] in ("confirmed", "finalized"):
+                        return True
+            except Exception as e:
+                logger.warning(f"Проверка статуса транзакции {tx_sig}: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CONFIRM_POLL_MAX)
+
+    try:
+        return await asyncio.wait_for(_poll(), timeout)
+    except asyncio.TimeoutError:
+        return False
+
+BALANCE_SNAPSHOT_TTL = 2  # секунд
+_balance_cache = {}  # {адрес кошелька: (цена SOL, баланс SOL, time.monotonic() истечения)}
+
+async def _get_balance_snapshot(wallet_address: str) -> tuple:
+    """
+    Цена SOL и баланс кошелька одним снимком на BALANCE_SNAPSHOT_TTL секунд: несколько покупок
+    с одного кошелька подряд не запрашивают их заново. После успешной покупки снимок сбрасывается.
+    """
+    cached = _balance_cache.get(wallet_address)
+    if cached and time.monotonic() < cached[2]:
+        return cached[0], cached[1]
+    # Цена SOL запрашивается синхронно (requests) в потоке, баланс - через aiohttp; оба параллельно
+    sol_price_usdt, wallet_balance_sol = await asyncio.gather(
+        asyncio.to_thread(get_sol_usdt_price),
+        get_wallet_balance(wallet_address),
+    )
+    if sol_price_usdt > 0 and wallet_balance_sol > 0:
+        _balance_cache[wallet_address] = (sol_price_usdt, wallet_balance_sol, time.monotonic() + BALANCE_SNAPSHOT_TTL)
+    return sol_price_usdt, wallet_balance_sol
+
+_trades_inflight = set()  # {(user_id, wallet_name, token_address)} - сделки, которые сейчас выполняются
+
+async def _exclusive_trade(user_id: int, wallet_name: str, token_address: str, trade) -> bool:
+    """
+    Не дает запустить вторую покупку/продажу того же токена с того же кошелька, пока первая не завершилась:
+    повторный вызов сразу возвращает False вместо второго маршрута Jupiter и двойного списания.
+    """
+    key = (user_id, wallet_name, token_address)
+    if key in _trades_inflight:
+        logger.info(f"Сделка по токену {token_address} для {user_id}/{wallet_name} уже выполняется, повтор пропущен")
+        trade.close()
+        return False
+    _trades_inflight.add(key)
+    try:
+        return await trade
+    finally:
+        _trades_inflight.discard(key)
+
 async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot):
+    return await _exclusive_trade(user_id, wallet_name, token_address, _buy_token(user_id, wallet_name, token_address, bot))
+
+async def _buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot):
     logger.info(f"Попытка покупки токена {token_address} для {user_id}/{wallet_name}")
-    wm = WalletManager()
 
-    token_metadata = get_token_metadata(token_address)
+    token_metadata = await asyncio.to_thread(get_token_metadata, token_address)
     token_name = token_metadata.get('name', 'Unknown')
     token_symbol = token_metadata.get('symbol', 'UNKNOWN')
 
-    try:
-        await send_token_analysis_to_group(bot, token_address)
-    except Exception as e:
-        logger.error(f"Ошибка отправки анализа токена {token_address} в группу: {e}")
+    _spawn(send_token_analysis_to_group(bot, token_address), f"Ошибка отправки анализа токена {token_address} в группу")
 
-    if is_potential_scam(token_address, token_name, token_symbol):
+    if await asyncio.to_thread(is_potential_scam, token_address, token_name, token_symbol):
         logger.warning(f"Токен {token_address} ({token_name}) заблокирован фильтрами.")
-        try:
-            await bot.send_message(
-                user_id,
-                f"❌ Покупка токена <b>{token_name} ({token_symbol})</b> отменена.\n"
-                f"Причина: Токен заблокирован фильтрами (потенциально скам).",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {user_id} о блокировке токена: {e}")
+        _notify(
+            bot,
+            user_id,
+            f"❌ Покупка токена <b>{token_name} ({token_symbol})</b> отменена.\n"
+            f"Причина: Токен заблокирован фильтрами (потенциально скам).",
+            parse_mode="HTML"
+        )
         return False
 
-    wallet_config = wm.get_wallet_config(user_id, wallet_name)
+    wallet = _WM.get_wallet_bundle(user_id, wallet_name)
+    wallet_config = wallet["config"]
     if not wallet_config:
         logger.error(f"Конфигурация кошелька {wallet_name} для пользователя {user_id} не найдена.")
         return False
@@ -297,37 +658,41 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
         logger.error(f"Неверный процент от баланса для кошелька {wallet_name}: {trade_percentage}%")
         return False
 
-    private_key_b58 = wm.get_wallet_private_key(user_id, wallet_name)
-    wallet_address = wm.get_wallet_address(user_id, wallet_name)
+    private_key_b58 = wallet["private_key"]
+    wallet_address = wallet["address"]
     if not private_key_b58 or not wallet_address:
         logger.error(f"Данные кошелька {wallet_name} для пользователя {user_id} не найдены.")
         return False
 
     try:
-        keypair = Keypair.from_bytes(base58.b58decode(private_key_b58))
+        keypair = _WM.get_wallet_keypair(user_id, wallet_name, private_key_b58)
     except Exception as e:
         logger.error(f"Ошибка декодирования приватного ключа для {wallet_name}: {e}")
         return False
 
     try:
-        sol_price_usdt = get_sol_usdt_price()
+        (sol_price_usdt, wallet_balance_sol), current_price_usdt = await asyncio.gather(
+            _get_balance_snapshot(wallet_address),
+            get_token_current_price(token_address),
+        )
         if sol_price_usdt <= 0:
             raise Exception("Failed to get SOL price")
 
-        wallet_balance_sol = wm.get_wallet_balance_solana(wallet_address)
         if wallet_balance_sol <= 0:
             raise Exception("Failed to get wallet balance")
 
-        current_price_usdt = await get_token_current_price(token_address)
         if current_price_usdt <= 0:
             raise Exception("Failed to get token price")
 
+        # Сумма покупки считается в лампортах целочисленно (процент в сотых долях); USDT нужен только для сообщений
+        wallet_balance_lamports = round(wallet_balance_sol * 1_000_000_000)
+        sol_to_spend_lamports = wallet_balance_lamports * round(trade_percentage * 100) // 10_000
+        purchase_amount_sol = sol_to_spend_lamports / 1_000_000_000
         wallet_balance_usdt = wallet_balance_sol * sol_price_usdt
-        purchase_amount_usdt = wallet_balance_usdt * (trade_percentage / 100.0)
-        purchase_amount_sol = purchase_amount_usdt / sol_price_usdt
+        purchase_amount_usdt = purchase_amount_sol * sol_price_usdt
 
-        logger.info(f"Кошелек {wallet_name}: Баланс {wallet_balance_sol:.6f} SOL ({wallet_balance_usdt:.6f} USDT). "
-                    f"Покупка на {trade_percentage}% = {purchase_amount_sol:.6f} SOL ({purchase_amount_usdt:.6f} USDT).")
+        logger.info("Кошелек %s: Баланс %.6f SOL (%.6f USDT). Покупка на %s%% = %.6f SOL (%.6f USDT).",
+                    wallet_name, wallet_balance_sol, wallet_balance_usdt, trade_percentage, purchase_amount_sol, purchase_amount_usdt)
 
         ATA_CREATION_COST_SOL = 0.00203928
         MINIMUM_GAS_FOR_FUTURE_TX = 0.00001
@@ -341,7 +706,8 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
                 [InlineKeyboardButton(text="🔄 Пополнить кошелек", url=deposit_url)]
             ])
             
-            await bot.send_message(
+            _notify(
+                bot,
                 user_id,
                 f"❌ Не удалось купить токен <b>{token_name} ({token_symbol})</b>.\n\n"
                 f"📊 Баланс кошелька: <b>{wallet_balance_sol:.6f} SOL</b>\n"
@@ -354,31 +720,27 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
             )
             return False
 
-        sol_to_spend_lamports = int(purchase_amount_sol * 1_000_000_000)
-
-        swap_transaction = get_jupiter_swap_transaction_improved(
+        swap_transaction = await get_jupiter_swap_transaction(
             input_mint="So11111111111111111111111111111111111111112",
             output_mint=token_address,
             amount=sol_to_spend_lamports,
             slippage=100,
-            user_public_key=wallet_address
+            user_public_key=wallet_address,
+            prioritization_fee_lamports=None  # приоритетная комиссия прежняя: Jupiter ее не добавляет
         )
 
         if not swap_transaction:
             logger.warning(f"❌ Не удалось создать маршрут обмена для токена {token_address}.")
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"❌ Покупка токена <b>{token_name} ({token_symbol})</b> не удалась.\n"
-                    f"Причина: Не удалось получить маршрут обмена.",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            _notify(
+                bot,
+                user_id,
+                f"❌ Покупка токена <b>{token_name} ({token_symbol})</b> не удалась.\n"
+                f"Причина: Не удалось получить маршрут обмена.",
+                parse_mode="HTML"
+            )
             return False
 
-        transaction_base64 = swap_transaction['swapTransaction']
-        raw_txn = base64.b64decode(transaction_base64)
+        raw_txn = decode_jupiter_transaction(swap_transaction['tx'])
         logger.info(f"Успешно декодирована транзакция из base64, длина: {len(raw_txn)} байт")
 
         transaction = VersionedTransaction.from_bytes(raw_txn)
@@ -389,15 +751,13 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
 
         if len(raw_signed_txn) > 1232:
             logger.error(f"Транзакция слишком большая: {len(raw_signed_txn)} байт")
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"❌ Транзакция покупки токена <b>{token_name} ({token_symbol})</b> слишком большая.\n"
-                    f"Размер: {len(raw_signed_txn)} байт (максимум 1232 байта).",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            _notify(
+                bot,
+                user_id,
+                f"❌ Транзакция покупки токена <b>{token_name} ({token_symbol})</b> слишком большая.\n"
+                f"Размер: {len(raw_signed_txn)} байт (максимум 1232 байта).",
+                parse_mode="HTML"
+            )
             return False
 
         # Используем теперь напрямую RPC метод sendTransaction
@@ -406,63 +766,32 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
             "skipPreflight": False,
             "preflightCommitment": "finalized"
         }
-        tx_sig = send_raw_transaction_via_rpc(raw_signed_txn, SOLANA_RPC_URL, config)
+        tx_sig = await send_raw_transaction_hedged(raw_signed_txn, config)
         logger.info(f"Транзакция покупки отправлена через RPC: {tx_sig}")
 
         # Ожидание подтверждения
-        start_time = time.time()
-        timeout = 70
-        while time.time() - start_time < timeout:
-            try:
-                # Для проверки статуса можно использовать getSignatureStatuses
-                status_payload = {
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "getSignatureStatuses",
-                    "params": [[tx_sig]]
-                }
-                status_response = requests.post(SOLANA_RPC_URL, json=status_payload, timeout=10)
-                if status_response.status_code == 200:
-                    status_data = status_response.json()
-                    if "result" in status_data and "value" in status_data["result"]:
-                        sig_status = status_data["result"]["value"][0]
-                        if sig_status is not None and sig_status["confirmationStatus"] in ["confirmed", "finalized"]:
-                            logger.info(f"Транзакция {tx_sig} подтверждена.")
-                            break
-            except Exception as e:
-                logger.warning(f"Проверка статуса транзакции: {e}")
-            
-            await asyncio.sleep(2)
+        if await wait_for_confirmation(tx_sig):
+            logger.info(f"Транзакция {tx_sig} подтверждена.")
         else:
             logger.error(f"Таймаут подтверждения транзакции: {tx_sig}")
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"❌ Транзакция покупки токена <b>{token_name} ({token_symbol})</b> не подтвердилась вовремя.\n"
-                    f"Signature: {tx_sig}\n"
-                    f"Проверьте позже в эксплорере.",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            _notify(
+                bot,
+                user_id,
+                f"❌ Транзакция покупки токена <b>{token_name} ({token_symbol})</b> не подтвердилась вовремя.\n"
+                f"Signature: {tx_sig}\n"
+                f"Проверьте позже в эксплорере.",
+                parse_mode="HTML"
+            )
             return False
 
         logger.info(f"Покупка токена {token_address} для {user_id}/{wallet_name} завершена успешно.")
+        _balance_cache.pop(wallet_address, None)  # баланс изменился
 
         profit_percentage = wallet_config.get('profit_percentage', 100.0)
         multiplier_for_target = 1 + (profit_percentage / 100.0)
         target_price_usdt = current_price_usdt * multiplier_for_target
 
-        purchased_tokens_file = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}.json")
-        purchased_tokens = {}
-        if os.path.exists(purchased_tokens_file):
-            try:
-                with open(purchased_tokens_file, 'r') as f:
-                    purchased_tokens = json.load(f)
-            except json.JSONDecodeError:
-                logger.warning(f"Ошибка чтения файла {purchased_tokens_file}, создается новый.")
-
-        purchased_tokens[token_address] = {
+        save_purchased_token(user_id, wallet_name, token_address, {
             "name": token_name,
             "symbol": token_symbol,
             "purchase_price_usdt": current_price_usdt,
@@ -472,66 +801,50 @@ async def buy_token(user_id: int, wallet_name: str, token_address: str, bot: Bot
             "purchase_amount_usdt": purchase_amount_usdt,
             "purchase_time": str(time.time()),
             "tx_signature": str(tx_sig)
-        }
-
-        os.makedirs(os.path.dirname(purchased_tokens_file), exist_ok=True)
-        with open(purchased_tokens_file, 'w') as f:
-            json.dump(purchased_tokens, f, indent=2)
-
-        try:
-            await bot.send_message(
-                user_id,
-                f"✅ Куплен токен <b>{token_name} ({token_symbol})</b>\n"
-                f"💰 Цена покупки: <b>{current_price_usdt:.6f} USDT</b>\n"
-                f"💸 Потрачено: <b>{purchase_amount_usdt:.6f} USDT</b> ({trade_percentage}% от баланса)\n"
-                f"🎯 Цель продажи: <b>{target_price_usdt:.6f} USDT</b> (+{profit_percentage}% / x{multiplier_for_target:.2f})\n"
-                f"📝 TX: <code>{tx_sig}</code>",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-            return True
+        })
+
+        _notify(
+            bot,
+            user_id,
+            f"✅ Куплен токен <b>{token_name} ({token_symbol})</b>\n"
+            f"💰 Цена покупки: <b>{current_price_usdt:.6f} USDT</b>\n"
+            f"💸 Потрачено: <b>{purchase_amount_usdt:.6f} USDT</b> ({trade_percentage}% от баланса)\n"
+            f"🎯 Цель продажи: <b>{target_price_usdt:.6f} USDT</b> (+{profit_percentage}% / x{multiplier_for_target:.2f})\n"
+            f"📝 TX: <code>{tx_sig}</code>",
+            parse_mode="HTML"
+        )
+        return True
     except Exception as e:
         logger.error(f"Необработанная ошибка при покупке токена {token_address} для {user_id}/{wallet_name}: {e}")
-        try:
-            await bot.send_message(
-                user_id,
-                f"❌ Критическая ошибка при покупке токена {token_name} ({token_symbol}):\n{str(e)[:200]}...",
-                parse_mode="HTML"
-            )
-        except Exception as ex:
-            logger.error(f"Ошибка отправки уведомления об ошибке пользователю {user_id}: {ex}")
+        _notify(
+            bot,
+            user_id,
+            f"❌ Критическая ошибка при покупке токена {token_name} ({token_symbol}):\n{str(e)[:200]}...",
+            parse_mode="HTML"
+        )
         return False
 
-async def check_and_sell_tokens(user_id: int, wallet_name: str, bot: Bot):
-    logger.info(f"Проверка целей продажи и убытков для {user_id}/{wallet_name}")
-    purchased_tokens_file = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}.json")
-    last_check_file = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}_last_check.json") # Файл для логов/состояния
+_last_check_prices = {}  # {путь файла последней проверки: записанные цены}
 
-    if not os.path.exists(purchased_tokens_file):
-        logger.info(f"Нет купленных токенов для {user_id}/{wallet_name}")
-        return
+async def check_and_sell_tokens(user_id: int, wallet_name: str, bot: Bot):
+    logger.info("Проверка целей продажи и убытков для %s/%s", user_id, wallet_name)
+    last_check_file = _purchased_tokens_paths(user_id, wallet_name)[2] # Файл для логов/состояния
 
     try:
-        with open(purchased_tokens_file, 'r') as f:
-            purchased_tokens = json.load(f)
-
-        # Загрузка состояния последней проверки
-        last_check_data = {}
-        if os.path.exists(last_check_file):
-            try:
-                with open(last_check_file, 'r') as f:
-                    last_check_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.warning(f"Файл состояния {last_check_file} поврежден, создается новый.")
+        purchased_tokens = load_purchased_tokens(user_id, wallet_name)
+        if not purchased_tokens:
+            logger.info("Нет купленных токенов для %s/%s", user_id, wallet_name)
+            return
 
         updated_tokens = {}
-        sold_any = False # Флаг для отслеживания продаж в этом цикле
+        to_sell = []  # (адрес токена, причина продажи)
+        current_prices = await get_token_current_prices(purchased_tokens)
         for token_address, token_data in purchased_tokens.items():
-            current_price_usdt = await get_token_current_price(token_address)
+            # Пока считаем, что токен остается; проданные уберем после продаж
+            updated_tokens[token_address] = token_data
+            current_price_usdt = current_prices[token_address]
             if current_price_usdt <= 0:
-                logger.warning(f"Не удалось получить цену для купленного токена {token_address}. Пропуск.")
-                updated_tokens[token_address] = token_data
+                logger.warning("Не удалось получить цену для купленного токена %s. Пропуск.", token_address)
                 continue
 
             purchase_price = token_data.get('purchase_price_usdt', 0)
@@ -544,83 +857,56 @@ async def check_and_sell_tokens(user_id: int, wallet_name: str, bot: Bot):
             # --- НОВОЕ: Проверка убытка ---
             loss_threshold = 0.8 * purchase_price # 20% убыток
             if current_price_usdt <= loss_threshold:
-                logger.info(f"Токен {token_address} упал до {current_price_usdt}, что ниже порога убытка ({loss_threshold}). Продажа...")
+                logger.info("Токен %s упал до %s, что ниже порога убытка (%s). Продажа...", token_address, current_price_usdt, loss_threshold)
                 # Устанавливаем целевую цену равной текущей для продажи по рынку
                 token_data['target_price_usdt'] = current_price_usdt
-                sold = await sell_token(user_id, wallet_name, token_address, bot, sell_reason="убыток_20%") # Передаем причину
-                if sold:
-                    sold_any = True
-                    # Удаляем токен из обновленного списка
-                    # Не добавляем в updated_tokens
-                    continue # Переходим к следующему токену
-                else:
-                    # Если продажа не удалась, сохраняем текущее состояние
-                    updated_tokens[token_address] = token_data
-                    continue # Переходим к следующему токену
+                to_sell.append((token_address, "убыток_20%"))
+                continue
 
             # --- Проверка цели прибыли ---
             # Добавим условие: не продавать, если цена ниже цены покупки (чтобы не продавать в убыток по цели)
             if current_price_usdt >= target_price and target_price > 0 and current_price_usdt >= purchase_price * 0.9:
-                logger.info(f"Цель продажи достигнута для {token_address} ({current_price_usdt} >= {target_price}). Продажа...")
-                sold = await sell_token(user_id, wallet_name, token_address, bot, sell_reason=f"цель_{profit_percentage_target}%") # Передаем причину
-                if sold:
-                    sold_any = True
-                    # Удаляем токен из обновленного списка
-                    # Не добавляем в updated_tokens
-                    continue # Переходим к следующему токену
-                else:
-                    # Если продажа не удалась, сохраняем текущее состояние
-                    updated_tokens[token_address] = token_data
-                    continue # Переходим к следующему токену
-
-            # Если токен не продан, сохраняем его в обновленный список
-            updated_tokens[token_address] = token_data
+                logger.info("Цель продажи достигнута для %s (%s >= %s). Продажа...", token_address, current_price_usdt, target_price)
+                to_sell.append((token_address, f"цель_{profit_percentage_target}%"))
+
+        # Продажи идут параллельно: котировка, swap и подтверждение одного токена не ждут другие
+        if to_sell:
+            results = await asyncio.gather(
+                *(sell_token(user_id, wallet_name, token_address, bot, sell_reason=reason) for token_address, reason in to_sell),
+                return_exceptions=True
+            )
+            for (token_address, _), sold in zip(to_sell, results):
+                if isinstance(sold, Exception):
+                    logger.error("Ошибка продажи токена %s для %s/%s: %s", token_address, user_id, wallet_name, sold)
+                elif sold:
+                    # sell_token уже удалил токен из купленных
+                    del updated_tokens[token_address]
+
+        # Сохраняем текущее состояние (цены) в файл последней проверки; если цены не изменились, файл не трогаем
+        checked_prices = {token_address: token_data.get('current_price_usdt', 0) for token_address, token_data in updated_tokens.items()}
+        if _last_check_prices.get(last_check_file) != checked_prices:
+            check_time = time.time()
+            _atomic_write_json(last_check_file, {
+                token_address: {"current_price_usdt": price, "last_check_time": check_time}
+                for token_address, price in checked_prices.items()
+            })
+            _last_check_prices[last_check_file] = checked_prices
 
-        # Если были продажи, обновляем файл купленных токенов
-        if sold_any:
-            with open(purchased_tokens_file, 'w') as f:
-                json.dump(updated_tokens, f, indent=2)
-            logger.info(f"Список купленных токенов для {user_id}/{wallet_name} обновлен после продажи.")
-
-        # Сохраняем текущее состояние (цены) в файл последней проверки
-        current_check_data = {}
-        for token_address, token_data in updated_tokens.items(): # Обновленный список после продаж
-            current_check_data[token_address] = {
-                "current_price_usdt": token_data.get('current_price_usdt', 0),
-                "last_check_time": time.time()
-            }
-
-        os.makedirs(os.path.dirname(last_check_file), exist_ok=True)
-        with open(last_check_file, 'w') as f:
-            json.dump(current_check_data, f, indent=2)
-
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON из файла {purchased_tokens_file}: {e}")
     except Exception as e:
         logger.error(f"Ошибка при проверке целей продажи для {user_id}/{wallet_name}: {e}")
 
 async def get_token_balance(wallet_address: str, token_address: str) -> int:
     try:
-        opts = TokenAccountOpts(mint=Pubkey.from_string(token_address))
-        payload = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "getTokenAccountsByOwner",
-            "params": [
-                wallet_address,
-                {"mint": token_address},
-                {"encoding": "jsonParsed"}
-            ]
-        }
-        response = requests.post(SOLANA_RPC_URL, json=payload, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if "result" in result and "value" in result["result"]:
-                accounts = result["result"]["value"]
-                if accounts:
-                    balance_str = accounts[0]["account"]["data"]["parsed"]["info"]["tokenAmount"]["amount"]
-                    return int(balance_str)
+        result = await _rpc("getTokenAccountsByOwner", [
+            wallet_address,
+            {"mint": token_address},
+            {"encoding": "jsonParsed"}
+        ])
+        if "result" in result and "value" in result["result"]:
+            accounts = result["result"]["value"]
+            if accounts:
+                balance_str = accounts[0]["account"]["data"]["parsed"]["info"]["tokenAmount"]["amount"]
+                return int(balance_str)
         return 0
         
     except Exception as e:
@@ -628,18 +914,23 @@ async def get_token_balance(wallet_address: str, token_address: str) -> int:
         return 0
 
 async def sell_token(user_id: int, wallet_name: str, token_address: str, bot: Bot, sell_reason: str = "цель") -> bool:
+    return await _exclusive_trade(
+        user_id, wallet_name, token_address, _sell_token(user_id, wallet_name, token_address, bot, sell_reason)
+    )
+
+async def _sell_token(user_id: int, wallet_name: str, token_address: str, bot: Bot, sell_reason: str) -> bool:
     logger.info(f"Попытка продажи токена {token_address} для {user_id}/{wallet_name}")
-    wm = WalletManager()
+    wallet = _WM.get_wallet_bundle(user_id, wallet_name)
     
-    private_key_b58 = wm.get_wallet_private_key(user_id, wallet_name)
-    wallet_address = wm.get_wallet_address(user_id, wallet_name)
+    private_key_b58 = wallet["private_key"]
+    wallet_address = wallet["address"]
     
     if not private_key_b58 or not wallet_address:
         logger.error(f"Данные кошелька {wallet_name} для пользователя {user_id} не найдены.")
         return False
         
     try:
-        keypair = Keypair.from_bytes(base58.b58decode(private_key_b58))
+        keypair = _WM.get_wallet_keypair(user_id, wallet_name, private_key_b58)
     except Exception as e:
         logger.error(f"Ошибка декодирования приватного ключа для {wallet_name}: {e}")
         return False
@@ -650,16 +941,17 @@ async def sell_token(user_id: int, wallet_name: str, token_address: str, bot: Bo
             logger.error(f"Нулевой баланс токена {token_address} на кошельке {wallet_address}")
             return False
 
-        token_metadata = get_token_metadata(token_address)
+        token_metadata = await asyncio.to_thread(get_token_metadata, token_address)
         token_name = token_metadata.get('name', 'Unknown')
         token_symbol = token_metadata.get('symbol', 'UNKNOWN')
 
-        swap_transaction = get_jupiter_swap_transaction_improved(
+        swap_transaction = await get_jupiter_swap_transaction(
             input_mint=token_address,
             output_mint="So11111111111111111111111111111111111111112",
             amount=token_balance,
             slippage=100,
-            user_public_key=wallet_address
+            user_public_key=wallet_address,
+            prioritization_fee_lamports=None  # приоритетная комиссия прежняя: Jupiter ее не добавляет
         )
         
         if not swap_transaction:
@@ -667,12 +959,9 @@ async def sell_token(user_id: int, wallet_name: str, token_address: str, bot: Bo
             return False
 
         try: 
-            transaction_base64 = swap_transaction['swapTransaction']
-            raw_txn = base64.b64decode(transaction_base64)
+            raw_txn = decode_jupiter_transaction(swap_transaction['tx'])
             transaction = VersionedTransaction.from_bytes(raw_txn)
-            message_bytes = bytes(transaction.message)
-            signature = keypair.sign_message(message_bytes)
-            signed_tx = VersionedTransaction(message_bytes, [signature])
+            signed_tx = VersionedTransaction(transaction.message, [keypair])
             raw_signed_txn = bytes(signed_tx)
         except Exception as e:
             logger.error(f"Ошибка при обработке или подписи транзакции продажи: {e}")
@@ -684,189 +973,204 @@ async def sell_token(user_id: int, wallet_name: str, token_address: str, bot: Bo
             "skipPreflight": False,
             "preflightCommitment": "finalized"
         }
-        tx_sig = send_raw_transaction_via_rpc(raw_signed_txn, SOLANA_RPC_URL, config)
+        tx_sig = await send_raw_transaction_hedged(raw_signed_txn, config)
         logger.info(f"Транзакция продажи отправлена через RPC: {tx_sig}")
         
         # Ожидание подтверждения продажи
-        start_time = time.time()
-        timeout = 70
-        while time.time() - start_time < timeout:
-            try:
-                status_payload = {
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "getSignatureStatuses",
-                    "params": [[tx_sig]]
-                }
-                status_response = requests.post(SOLANA_RPC_URL, json=status_payload, timeout=10)
-                if status_response.status_code == 200:
-                    status_data = status_response.json()
-                    if "result" in status_data and "value" in status_data["result"]:
-                        sig_status = status_data["result"]["value"][0]
-                        if sig_status is not None and sig_status["confirmationStatus"] in ["confirmed", "finalized"]:
-                            logger.info(f"Транзакция продажи {tx_sig} подтверждена.")
-                            break
-            except Exception as e:
-                logger.warning(f"Проверка статуса транзакции продажи: {e}")
-            
-            await asyncio.sleep(2)
+        if await wait_for_confirmation(tx_sig):
+            logger.info(f"Транзакция продажи {tx_sig} подтверждена.")
         else:
             logger.error(f"Таймаут подтверждения транзакции продажи: {tx_sig}")
             return False
 
         logger.info(f"Продажа токена {token_address} для {user_id}/{wallet_name} завершена успешно.")
 
-        purchased_tokens_file = os.path.join(PURCHASED_TOKENS_DIR, f"{user_id}_{wallet_name}.json")
         purchase_price = 0.0
         purchase_amount = 0.0
         profit_percent_target = 0.0
         
-        if os.path.exists(purchased_tokens_file):
-            try:
-                with open(purchased_tokens_file, 'r') as f:
-                    purchased_tokens = json.load(f)
-                token_data = purchased_tokens.get(token_address, {})
-                purchase_price = token_data.get('purchase_price_usdt', 0)
-                purchase_amount = token_data.get('purchase_amount_usdt', 0)
-                profit_percent_target = token_data.get('profit_percentage_target', 100.0)
-            except Exception as e:
-                logger.error(f"Ошибка получения данных токена из файла {purchased_tokens_file} для уведомления: {e}")
-
         try:
-            await bot.send_message(
-                user_id,
-                f"✅ Продан токен <b>{token_name} ({token_symbol})</b>\n"
-                f"💰 Цена покупки: <b>{purchase_price:.6f} USDT</b>\n"
-                f"💸 Потрачено: <b>{purchase_amount:.6f} USDT</b>\n"
-                f"🎯 Цель была: +{profit_percent_target}%\n"
-                f"📝 TX: <code>{tx_sig}</code>\n"
-                f"✅ Токен успешно продан.",
-                parse_mode="HTML"
-            )
+            token_data = load_purchased_tokens(user_id, wallet_name).get(token_address, {})
+            purchase_price = token_data.get('purchase_price_usdt', 0)
+            purchase_amount = token_data.get('purchase_amount_usdt', 0)
+            profit_percent_target = token_data.get('profit_percentage_target', 100.0)
+            if token_data:
+                remove_purchased_tokens(user_id, wallet_name, [token_address])
         except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {user_id} об успешной продаже: {e}")
+            logger.error(f"Ошибка обновления купленных токенов {user_id}/{wallet_name} после продажи: {e}")
+
+        _notify(
+            bot,
+            user_id,
+            f"✅ Продан токен <b>{token_name} ({token_symbol})</b>\n"
+            f"💰 Цена покупки: <b>{purchase_price:.6f} USDT</b>\n"
+            f"💸 Потрачено: <b>{purchase_amount:.6f} USDT</b>\n"
+            f"🎯 Цель была: +{profit_percent_target}%\n"
+            f"📝 TX: <code>{tx_sig}</code>\n"
+            f"✅ Токен успешно продан.",
+            parse_mode="HTML"
+        )
 
         return True
 
     except Exception as e:
         logger.error(f"Ошибка при продаже токена {token_address} для {user_id}/{wallet_name}: {e}")
-        try:
-            await bot.send_message(
-                user_id,
-                f"❌ Ошибка продажи токена {token_address}:\n{str(e)[:200]}...",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления об ошибке пользователю {user_id}: {e}")
+        _notify(
+            bot,
+            user_id,
+            f"❌ Ошибка продажи токена {token_address}:\n{str(e)[:200]}...",
+            parse_mode="HTML"
+        )
         return False
 
 NEW_TOKENS_FILE = os.path.join(PURCHASED_TOKENS_DIR, 'new_tokens.json')
+NEW_TOKENS_CHECK_INTERVAL = 30  # секунд; плановая перепроверка цен, если новых токенов не появилось
+NEW_TOKENS_IDLE_INTERVAL = 300  # секунд; контрольная перепроверка файла, пока отслеживаемых токенов нет
+_new_token_event = asyncio.Event()  # будит monitor_new_tokens сразу после сохранения нового токена
+
+# Поля, по которым повторное сохранение считается той же позицией; purchase_time у каждой покупки свой
+NEW_TOKEN_KEY_FIELDS = ('purchase_price_usdt', 'user_id', 'wallet_name')
 
-def save_new_token(token_address: str, token_data, dict):
+def save_new_token(token_address: str, token_data: dict):
     try:
         if not os.path.exists(NEW_TOKENS_FILE):
             new_tokens = {}
         else:
-            with open(NEW_TOKENS_FILE, 'r') as f:
-                new_tokens = json.load(f)
+            with open(NEW_TOKENS_FILE, 'rb') as f:
+                new_tokens = orjson.loads(f.read())
         
+        saved = new_tokens.get(token_address)
+        if saved and all(saved.get(field) == token_data.get(field) for field in NEW_TOKEN_KEY_FIELDS):
+            return
         new_tokens[token_address] = token_data
-        
-        os.makedirs(os.path.dirname(NEW_TOKENS_FILE), exist_ok=True)
-        with open(NEW_TOKENS_FILE, 'w') as f:
-            json.dump(new_tokens, f, indent=2)
+        _atomic_write_json(NEW_TOKENS_FILE, new_tokens)
+        _new_token_event.set()
             
     except Exception as e:
         logger.error(f"Ошибка сохранения нового токена {token_address}: {e}")
 
+def _mark_notified_tiers(notified_tiers: dict):
+    """
+    Сохраняет достигнутый уровень уведомления {адрес: tier} в new_tokens.json. Файл перечитывается
+    непосредственно перед записью, чтобы не затереть токены, добавленные покупкой во время проверки цен.
+    """
+    try:
+        new_tokens = get_new_tokens()
+        for token_address, tier in notified_tiers.items():
+            if token_address in new_tokens:
+                new_tokens[token_address]["notified_tier"] = tier
+        _atomic_write_json(NEW_TOKENS_FILE, new_tokens)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения уровней уведомлений новых токенов: {e}")
+
+def _is_wallet_token(token_data: dict, user_id: int, wallet_name: str) -> bool:
+    return token_data.get('user_id') == user_id and token_data.get('wallet_name') == wallet_name
+
+def _drop_new_tokens(should_drop):
+    """
+    Убирает из new_tokens.json записи, для которых should_drop(адрес, данные) истинно: проданные позиции
+    и токены удаленных кошельков, чтобы monitor_new_tokens не запрашивал по ним цены и не слал уведомления.
+    """
+    try:
+        new_tokens = get_new_tokens()
+        stale = [token_address for token_address, token_data in new_tokens.items() if should_drop(token_address, token_data)]
+        if not stale:
+            return
+        for token_address in stale:
+            del new_tokens[token_address]
+        _atomic_write_json(NEW_TOKENS_FILE, new_tokens)
+        logger.info(f"Из отслеживания новых токенов убрано {len(stale)} позиций")
+    except Exception as e:
+        logger.error(f"Ошибка очистки списка новых токенов: {e}")
+
 def get_new_tokens() -> dict:
     try:
         if not os.path.exists(NEW_TOKENS_FILE):
             return {}
         
-        with open(NEW_TOKENS_FILE, 'r') as f:
-            return json.load(f)
+        with open(NEW_TOKENS_FILE, 'rb') as f:
+            return orjson.loads(f.read())
     except Exception as e:
         logger.error(f"Ошибка получения новых токенов: {e}")
         return {}
 
+_shutdown = asyncio.Event()  # сигнал остановки мониторов: циклы выходят, не досыпая интервал
+
+def stop_monitoring():
+    _shutdown.set()
+
+async def _sleep_unless_stopped(timeout: float, wake_event: asyncio.Event = None):
+    """Пауза до timeout секунд; прерывается сигналом остановки и, если передан, событием wake_event."""
+    waiters = [asyncio.ensure_future(_shutdown.wait())]
+    if wake_event is not None:
+        waiters.append(asyncio.ensure_future(wake_event.wait()))
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
 async def monitor_new_tokens(bot: Bot):
-    while True:
+    # Записи, оставшиеся от продаж и удалений кошельков до появления очистки: позиции уже нет в купленных токенах
+    _drop_new_tokens(lambda token_address, token_data: token_address not in load_purchased_tokens(
+        token_data.get('user_id'), token_data.get('wallet_name')))
+    while not _shutdown.is_set():
         try:
             new_tokens = get_new_tokens()
+            if not new_tokens:
+                # Отслеживать нечего: ждем сохранения первого токена, без запросов цен
+                await _sleep_unless_stopped(NEW_TOKENS_IDLE_INTERVAL, _new_token_event)
+                _new_token_event.clear()
+                continue
+            # Цены всех отслеживаемых токенов одним пакетом вместо последовательных запросов по одному
+            prices = await get_token_current_prices(new_tokens)
+            notified_tiers = {}
             
             for token_address, token_data in new_tokens.items():
                 try:
-                    current_price = await get_token_current_price(token_address)
+                    current_price = prices.get(token_address, 0.0)
                     if current_price > 0:
                         purchase_price = token_data.get('purchase_price_usdt', 0)
                         if purchase_price > 0:
-                            profit_percent = ((current_price - purchase_price) / purchase_price) * 100
-                            multiplier = current_price / purchase_price
+                            profit_percent, multiplier, _ = _token_status(purchase_price, current_price)
                             
                             user_id = token_data.get('user_id')
                             wallet_name = token_data.get('wallet_name')
                             
-                            if multiplier >= 4:
-                                await bot.send_message(
+                            # Уведомление только при переходе на новый уровень, а не на каждой проверке
+                            tier = bisect.bisect_right(TIER_THRESHOLDS, multiplier)
+                            if tier > token_data.get('notified_tier', 0):
+                                notified_tiers[token_address] = tier
+                                _notify(
+                                    bot,
                                     user_id,
-                                    f"🚀 Токен <b>{token_data.get('name', 'Unknown')} ({token_data.get('symbol', 'UNKNOWN')})</b> достиг x4!\n"
-                                    f"📈 Текущая цена: <b>{current_price:.6f} USDT</b>\n"
-                                    f"💰 Прибыль: <b>+{profit_percent:.2f}%</b> (x{multiplier:.2f})",
-                                    parse_mode="HTML"
-                                )
-                            elif multiplier >= 3:
-                                await bot.send_message(
-                                    user_id,
-                                    f"🟢 Токен <b>{token_data.get('name', 'Unknown')} ({token_data.get('symbol', 'UNKNOWN')})</b> достиг x3!\n"
-                                    f"📈 Текущая цена: <b>{current_price:.6f} USDT</b>\n"
-                                    f"💰 Прибыль: <b>+{profit_percent:.2f}%</b> (x{multiplier:.2f})",
-                                    parse_mode="HTML"
-                                )
-                            elif multiplier >= 2:
-                                await bot.send_message(
-                                    user_id,
-                                    f"🟡 Токен <b>{token_data.get('name', 'Unknown')} ({token_data.get('symbol', 'UNKNOWN')})</b> достиг x2!\n"
-                                    f"📈 Текущая цена: <b>{current_price:.6f} USDT</b>\n"
-                                    f"💰 Прибыль: <b>+{profit_percent:.2f}%</b> (x{multiplier:.2f})",
+                                    TIER_ALERT_TEMPLATES[tier - 1].format_map({
+                                        "name": token_data.get('name', 'Unknown'),
+                                        "symbol": token_data.get('symbol', 'UNKNOWN'),
+                                        "price": current_price,
+                                        "profit": profit_percent,
+                                        "multiplier": multiplier,
+                                    }),
                                     parse_mode="HTML"
                                 )
                 except Exception as e:
                     logger.error(f"Ошибка мониторинга нового токена {token_address}: {e}")
+            if notified_tiers:
+                _mark_notified_tiers(notified_tiers)
             
-            await asyncio.sleep(30)
+            # Ждем нового токена, но не дольше интервала плановой проверки цен
+            await _sleep_unless_stopped(NEW_TOKENS_CHECK_INTERVAL, _new_token_event)
+            _new_token_event.clear()
             
         except Exception as e:
             logger.error(f"Ошибка в мониторинге новых токенов: {e}")
-            await asyncio.sleep(30)
-
-async def start_monitoring(bot: Bot):
-    task1 = asyncio.create_task(monitor_purchased_tokens(bot))
-    task2 = asyncio.create_task(monitor_new_tokens(bot))
-    
-    await asyncio.gather(task1, task2)
-
-async def monitor_purchased_tokens(bot: Bot):
-    while True:
-        try:
-            wm = WalletManager() # Инициализация WalletManager
-            all_wallets = wm.get_all_wallets() # Получить все кошельки всех пользователей
-            logger.info(f"Найдено {len(all_wallets)} кошельков для проверки.")
-            for user_id, wallet_name in all_wallets: # Перебрать все
-                logger.info(f"Проверка целей продажи для {user_id}/{wallet_name}")
-                await check_and_sell_tokens(user_id, wallet_name, bot) # Вызвать проверку для каждого
-              
-            await asyncio.sleep(60)
-            
-        except Exception as e:
-            logger.error(f"Ошибка в мониторинге купленных токенов: {e}")
-            await asyncio.sleep(60)
+            await _sleep_unless_stopped(NEW_TOKENS_CHECK_INTERVAL)
 
 async def buy_token_with_monitoring(user_id: int, wallet_name: str, token_address: str, bot: Bot):
     success = await buy_token(user_id, wallet_name, token_address, bot)
     
     if success:
-        token_metadata = get_token_metadata(token_address)
+        token_metadata = await asyncio.to_thread(get_token_metadata, token_address)
         token_name = token_metadata.get('name', 'Unknown')
         token_symbol = token_metadata.get('symbol', 'UNKNOWN')
         
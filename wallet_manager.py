@@ -1,19 +1,46 @@
-import json
+import copy
+import functools
 import logging
 import os
-from mnemonic import Mnemonic
+import orjson
+from cachetools import LRUCache
 from solders.keypair import Keypair
 import base58
 import requests
 import time
+from requests.adapters import HTTPAdapter
 from solders.pubkey import Pubkey
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 CONFIG_DIR = 'config'
 USER_CONFIGS_DIR = os.path.join(CONFIG_DIR, 'wallets')
 SOLANA_RPC_URL = "https://api.mainnet-beta.solana.com"
+# Одна сессия на модуль: keep-alive соединение с RPC вместо нового TLS-рукопожатия на каждый запрос баланса
+# Пул рассчитан на параллельные запросы балансов из asyncio.to_thread (по умолчанию urllib3 держит 10 соединений)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
+# Разобранные конфиги пользователей, общие для всех экземпляров WalletManager:
+# {user_id: ((st_mtime_ns, st_size), config)}. Файл перечитывается только после его изменения.
+_config_cache = {}
+# Список всех кошельков (user_id, имя) и mtime каталога конфигов, по которому он собран. Конфиги
+# записываются через os.replace, поэтому любое сохранение, добавление или удаление файла меняет mtime каталога
+_all_wallets_cache = (None, [])
+
+# Расшифрованные ключи: {(user_id, wallet_name): (private_key_b58, Keypair)}. base58 и Keypair.from_bytes
+# выполняются один раз, пока приватный ключ кошелька в конфиге не сменился
+KEYPAIR_CACHE_SIZE = 512
+_keypair_cache = LRUCache(maxsize=KEYPAIR_CACHE_SIZE)
+
+@functools.lru_cache(maxsize=1024)
+def _user_config_path(user_id: int) -> str:
+    """Путь к конфигу пользователя; вычисляется один раз на user_id."""
+    return os.path.join(USER_CONFIGS_DIR, f"{user_id}.json")
+
+def _file_signature(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
 
 class WalletManager:
     def __init__(self):
@@ -23,30 +50,41 @@ class WalletManager:
 
     def _get_user_config_file(self, user_id: int) -> str:
         """Получает путь к файлу конфигурации пользователя"""
-        return os.path.join(USER_CONFIGS_DIR, f"{user_id}.json")
+        return _user_config_path(user_id)
 
     def load_user_config(self, user_id: int) -> dict:
-        """Загружает конфигурацию пользователя"""
+        """
+        Загружает конфигурацию пользователя. Возвращает общий закэшированный объект - его нельзя
+        изменять на месте; для изменений используйте копию и save_user_config.
+        """
         config_file = self._get_user_config_file(user_id)
         try:
             if os.path.exists(config_file):
-                with open(config_file, 'r') as f:
-                    return json.load(f)
+                signature = _file_signature(config_file)
+                cached = _config_cache.get(user_id)
+                if cached and cached[0] == signature:
+                    return cached[1]
+                with open(config_file, 'rb') as f:
+                    config = orjson.loads(f.read())
+                _config_cache[user_id] = (signature, config)
+                return config
             else:
                 # Создаем пустой файл
-                with open(config_file, 'w') as f:
-                    json.dump({}, f)
+                self.save_user_config(user_id, {})
                 return {}
         except Exception as e:
             logger.error(f"Ошибка загрузки конфига пользователя {user_id}: {e}")
             return {}
 
     def save_user_config(self, user_id: int, config: dict):
-        """Сохраняет конфигурацию пользователя"""
+        """Сохраняет конфигурацию пользователя атомарно (временный файл + os.replace)"""
         config_file = self._get_user_config_file(user_id)
+        tmp_file = config_file + '.tmp'
         try:
-            with open(config_file, 'w') as f:
-                json.dump(config, f, indent=2)
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(config))
+            os.replace(tmp_file, config_file)
+            _config_cache[user_id] = (_file_signature(config_file), config)
         except Exception as e:
             logger.error(f"Ошибка сохранения конфига пользователя {user_id}: {e}")
 
@@ -68,7 +106,7 @@ class WalletManager:
                                 f"но указан {address}. Несоответствие!")
 
             # Готовим конфиг
-            user_config = self.load_user_config(user_id)
+            user_config = copy.deepcopy(self.load_user_config(user_id))
             if "wallets" not in user_config:
                 user_config["wallets"] = {}
 
@@ -117,7 +155,7 @@ class WalletManager:
                 "Content-Type": "application/json"
             }
 
-            response = requests.post(SOLANA_RPC_URL, json=payload, headers=headers, timeout=10)
+            response = _SESSION.post(SOLANA_RPC_URL, json=payload, headers=headers, timeout=10)
 
             if response.status_code == 200:
                 result = response.json()
@@ -145,6 +183,23 @@ class WalletManager:
             return wallets[wallet_name].get('private_key', '')
         return ''
 
+    def get_wallet_keypair(self, user_id: int, wallet_name: str, private_key_b58: str = None) -> Keypair:
+        """
+        Keypair кошелька для подписи транзакций (из кэша, пока ключ в конфиге не изменился).
+        Если приватный ключ уже прочитан вызывающим кодом, его можно передать, чтобы не искать кошелек повторно.
+        """
+        if private_key_b58 is None:
+            private_key_b58 = self.get_wallet_private_key(user_id, wallet_name)
+        if not private_key_b58:
+            raise ValueError(f"Приватный ключ кошелька {wallet_name} пользователя {user_id} не найден")
+        cache_key = (user_id, wallet_name)
+        cached = _keypair_cache.get(cache_key)
+        if cached and cached[0] == private_key_b58:
+            return cached[1]
+        keypair = Keypair.from_bytes(base58.b58decode(private_key_b58))
+        _keypair_cache[cache_key] = (private_key_b58, keypair)
+        return keypair
+
     def get_wallet_address(self, user_id: int, wallet_name: str) -> str:
         """Получает адрес кошелька пользователя"""
         wallets = self.get_user_wallets(user_id)
@@ -152,6 +207,15 @@ class WalletManager:
             return wallets[wallet_name].get('address', '')
         return ''
 
+    def get_wallet_bundle(self, user_id: int, wallet_name: str) -> dict:
+        """Адрес, приватный ключ и конфигурация кошелька за одно обращение к конфигу пользователя"""
+        wallet_config = self.get_wallet_config(user_id, wallet_name)
+        return {
+            "address": wallet_config.get('address', ''),
+            "private_key": wallet_config.get('private_key', ''),
+            "config": wallet_config,
+        }
+
     def get_wallet_config(self, user_id: int, wallet_name: str) -> dict:
         """Получает конфигурацию конкретного кошелька пользователя (цены, цели)"""
         user_config = self.load_user_config(user_id)
@@ -162,7 +226,7 @@ class WalletManager:
 
     def update_wallet_config(self, user_id: int, wallet_name: str, updates: dict):
         """Обновляет конфигурацию конкретного кошелька пользователя"""
-        user_config = self.load_user_config(user_id)
+        user_config = copy.deepcopy(self.load_user_config(user_id))
         if "wallets" not in user_config:
             user_config["wallets"] = {}
         if wallet_name not in user_config["wallets"]:
@@ -172,25 +236,30 @@ class WalletManager:
         self.save_user_config(user_id, user_config)
     
     def delete_wallet_config(self, user_id: int, wallet_name: str):
-        config_file = os.path.join(self.wallets_dir, f"{user_id}.json")
+        config_file = self._get_user_config_file(user_id)
         if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                wallets = json.load(f)
+            user_config = copy.deepcopy(self.load_user_config(user_id))
+            wallets = user_config.get("wallets", {})
             if wallet_name in wallets:
                 del wallets[wallet_name]
+                _keypair_cache.pop((user_id, wallet_name), None)
                 # Если других кошельков у пользователя нет, удаляем весь файл
                 if not wallets:
                     os.remove(config_file)
+                    _config_cache.pop(user_id, None)
                     logger.info(f"Файл конфигурации пользователя {user_id} удален, так как нет кошельков.")
                 else:
-                    with open(config_file, 'w') as f:
-                        json.dump(wallets, f, indent=2)
+                    self.save_user_config(user_id, user_config)
                     logger.info(f"Кошелек {wallet_name} пользователя {user_id} удален из конфигурации.")
             else:
                 logger.warning(f"Кошелек {wallet_name} не найден для пользователя {user_id} при попытке удаления.")
         else:
             logger.warning(f"Файл конфигурации {config_file} не найден при попытке удаления кошелька {wallet_name}.")
     def get_all_wallets(self):
+        global _all_wallets_cache
+        dir_mtime = os.stat(self.wallets_dir).st_mtime_ns
+        if _all_wallets_cache[0] == dir_mtime:
+            return list(_all_wallets_cache[1])
         all_wallets = []
         for filename in os.listdir(self.wallets_dir):
             if filename.endswith('.json'):
@@ -199,7 +268,8 @@ class WalletManager:
                     user_config = self.load_user_config(user_id)
                     for wallet_name in user_config.get("wallets", {}).keys():
                         all_wallets.append((user_id, wallet_name))
-                except (ValueError, json.JSONDecodeError) as e:
+                except ValueError as e:
                     logger.warning(f"Проблема с файлом конфигурации {filename}: {e}")
                     continue
-        return all_wallets
+        _all_wallets_cache = (dir_mtime, all_wallets)
+        return list(all_wallets)